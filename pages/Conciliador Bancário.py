@@ -1,10 +1,21 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import pdfplumber
 import re
 import io
 import os
+import tempfile
+import hashlib
+import shutil
 import datetime
+import time
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import zipfile
+import rarfile
 import xlsxwriter  # Obrigatório estar no requirements.txt
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
@@ -14,6 +25,8 @@ from reportlab.lib.units import mm
 from PIL import Image
 import fitz  # Requer pymupdf no requirements.txt
 
+rarfile.UNRAR_TOOL = "unrar"
+
 # --- CONFIGURAÇÃO DA PÁGINA ---
 icon_path = os.path.join(os.getcwd(), "Barcarena.png")
 try:
@@ -44,6 +57,19 @@ st.markdown("""
 # 1. FUNÇÕES DE PROCESSAMENTO
 # ==============================================================================
 CURRENT_YEAR = str(datetime.datetime.now().year)
+LIMITE_ITENS_AGRUPAMENTO = 4       # Máx. de lançamentos do razão somados para um único débito
+LIMITE_ACASO_AGRUPAMENTO = 0.01    # Máx. de combinações do dia que fechariam o débito só por acaso (estimativa)
+TEMPO_LIMITE_AGRUPAMENTO_DIA = 0.25  # Segundos de busca por data
+N_PROCESSOS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+PAGINAS_MIN_PARALELO = 40          # Abaixo disso a leitura sequencial é mais rápida que subir o pool
+MOTORES_EXTRACAO = ["pdfplumber", "pymupdf"]
+TOLERANCIA_COORDS = 1.0            # Desvio máximo (pt) aceito entre os motores na caixa do valor
+LINHAS_POR_PAGINA = 100            # Lançamentos (Mestre) por página da tabela em tela
+FILTROS_RESULTADO = ("filtro_div", "filtro_periodo", "filtro_doc")  # Chaves dos widgets de filtro da tabela
+DOC_NAO_LOCALIZADO = "NÃO LOCALIZADO"
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "conciliador_bancario_cache")
+CACHE_LIMITE_BYTES = 500 * 1024 * 1024  # Acima disso as entradas menos usadas são removidas
+VERSAO_CACHE = 3                   # Incrementar a cada mudança na leitura do extrato/razão ou na conciliação
 
 def limpar_documento_pdf(doc_str):
     if not doc_str: return ""
@@ -63,61 +89,124 @@ def parse_br_date(date_val):
         return pd.to_datetime(date_val, dayfirst=True, errors='coerce')
     except: return pd.to_datetime(date_val, errors='coerce')
 
-def processar_pdf(file_bytes):
+def valor_em_centavos(serie):
+    return (pd.to_numeric(serie, errors='coerce') * 100).round()
+
+def interpretar_palavras_pagina(page_idx, words):
+    linhas_dict = {}
+    for w in words:
+        top = round(w['top'], 1)
+        linhas_dict.setdefault(top, []).append(w)
+    
+    for top in sorted(linhas_dict.keys()):
+        linha_words = linhas_dict[top]
+        texto_linha = " ".join([w['text'] for w in linha_words])
+        match_data = re.search(r'^(\d{2}/\d{2}(?:/\d{4})?)', texto_linha)
+        if not match_data: continue 
+        
+        data_str = match_data.group(1)
+        if len(data_str) == 5: data_str = f"{data_str}/{CURRENT_YEAR}"
+        match_valor = re.search(r'(\d{1,3}(?:\.\d{3})*,\d{2})\s?([DC])', texto_linha)
+        
+        if match_valor:
+            valor_bruto = match_valor.group(1)
+            tipo = match_valor.group(2)
+            valor_float = float(valor_bruto.replace('.', '').replace(',', '.'))
+            
+            coord_box = None
+            for w in linha_words:
+                if valor_bruto in w['text']:
+                    coord_box = (page_idx, w['x0'], w['top'], w['x1'], w['bottom'])
+                    break
+
+            texto_sem_data = texto_linha.replace(match_data.group(0), "", 1).strip()
+            texto_sem_valor = texto_sem_data.replace(match_valor.group(0), "").strip()
+            
+            entry = {
+                "Data": data_str, "Histórico": texto_sem_valor.strip(),
+                "Documento": "", "Valor_Extrato": valor_float, "coords": coord_box
+            }
+
+            if tipo == 'D':
+                tokens = texto_sem_valor.split()
+                if tokens:
+                    for t in reversed(tokens):
+                        limpo = t.replace('.', '').replace('-', '')
+                        if limpo.isdigit() and len(limpo) >= 4:
+                            entry["Documento"] = limpar_documento_pdf(t)
+                            break
+                yield 'D', entry
+            elif tipo == 'C':
+                hist_upper = texto_sem_valor.upper()
+                if any(x in hist_upper for x in ["TED DEVOLVIDA", "DEVOLUCAO DE TED", "TED DEVOL"]):
+                    yield 'C', entry
+
+def palavras_pymupdf(page):
+    # Mesmo formato do extract_words do pdfplumber, ordenado por linha e depois por x
+    words = [{'text': w[4], 'x0': w[0], 'top': w[1], 'x1': w[2], 'bottom': w[3]} for w in page.get_text("words")]
+    words.sort(key=lambda w: (round(w['top'], 1), w['x0']))
+    return words
+
+def extrair_lancamentos_pdf(file_bytes, motor="pdfplumber", inicio=0, fim=None):
+    # Gera os lançamentos página a página, liberando o cache de layout de cada página após a leitura
+    if motor == "pymupdf":
+        fitz.TOOLS.set_small_glyph_heights(True)  # Caixas na altura da fonte, como no pdfplumber
+        with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+            for page_idx in range(inicio, doc.page_count if fim is None else fim):
+                yield from interpretar_palavras_pagina(page_idx, palavras_pymupdf(doc[page_idx]))
+    else:
+        paginas = None if fim is None else list(range(inicio + 1, fim + 1))
+        with pdfplumber.open(io.BytesIO(file_bytes), pages=paginas) as pdf:
+            for page in pdf.pages:
+                words = page.extract_words(x_tolerance=2, y_tolerance=2)
+                page.flush_cache()
+                yield from interpretar_palavras_pagina(page.page_number - 1, words)
+
+# Extratos em leitura paralela, por token: gravados antes de criar o pool e herdados pelos workers via fork,
+# para que cada tarefa leve só (token, motor, intervalo) em vez de uma cópia do PDF
+PDFS_EM_LEITURA = {}
+
+def extrair_intervalo_paginas(args):
+    # Worker: lê as páginas [inicio, fim) e devolve os lançamentos já com o índice global da página
+    token, motor, inicio, fim = args
+    return list(extrair_lancamentos_pdf(PDFS_EM_LEITURA[token], motor, inicio, fim))
+
+def executor_processos(max_workers):
+    # fork e não forkserver/spawn: o Streamlit executa a página como script (instalada como __main__), então um
+    # processo novo não consegue reimportá-la para achar as funções de worker nem os dados em PDFS_EM_LEITURA.
+    # O risco do fork num servidor com várias threads (um lock de outra thread copiado já travado) é contido
+    # porque os workers só executam a leitura/conciliação (pdfplumber, fitz, pandas): não chamam st.*, logging
+    # nem nada que as threads do servidor seguram, e devolvem o resultado pelo próprio pool.
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork"))
+
+def extrair_lancamentos_pdf_paralelo(file_bytes, n_paginas, motor="pdfplumber", n_processos=N_PROCESSOS):
+    tamanho = max(1, -(-n_paginas // (n_processos * 2)))
+    token = os.urandom(8).hex()  # Sessões simultâneas não se misturam
+    intervalos = [(token, motor, i, min(i + tamanho, n_paginas)) for i in range(0, n_paginas, tamanho)]
+    PDFS_EM_LEITURA[token] = file_bytes
+    try:
+        with executor_processos(n_processos) as executor:
+            # map preserva a ordem dos intervalos -> linhas na ordem das páginas
+            for lote in executor.map(extrair_intervalo_paginas, intervalos):
+                yield from lote
+    finally:
+        PDFS_EM_LEITURA.pop(token, None)
+
+def processar_pdf(file_bytes, paralelo=None, motor="pdfplumber"):
     rows_debitos = []
     rows_devolucoes = []
     
     try:
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            for page_idx, page in enumerate(pdf.pages):
-                words = page.extract_words(x_tolerance=2, y_tolerance=2)
-                linhas_dict = {}
-                for w in words:
-                    top = round(w['top'], 1)
-                    linhas_dict.setdefault(top, []).append(w)
-                
-                for top in sorted(linhas_dict.keys()):
-                    linha_words = linhas_dict[top]
-                    texto_linha = " ".join([w['text'] for w in linha_words])
-                    match_data = re.search(r'^(\d{2}/\d{2}(?:/\d{4})?)', texto_linha)
-                    if not match_data: continue 
-                    
-                    data_str = match_data.group(1)
-                    if len(data_str) == 5: data_str = f"{data_str}/{CURRENT_YEAR}"
-                    match_valor = re.search(r'(\d{1,3}(?:\.\d{3})*,\d{2})\s?([DC])', texto_linha)
-                    
-                    if match_valor:
-                        valor_bruto = match_valor.group(1)
-                        tipo = match_valor.group(2)
-                        valor_float = float(valor_bruto.replace('.', '').replace(',', '.'))
-                        
-                        coord_box = None
-                        for w in linha_words:
-                            if valor_bruto in w['text']:
-                                coord_box = (page_idx, w['x0'], w['top'], w['x1'], w['bottom'])
-                                break
-
-                        texto_sem_data = texto_linha.replace(match_data.group(0), "", 1).strip()
-                        texto_sem_valor = texto_sem_data.replace(match_valor.group(0), "").strip()
-                        
-                        entry = {
-                            "Data": data_str, "Histórico": texto_sem_valor.strip(),
-                            "Documento": "", "Valor_Extrato": valor_float, "coords": coord_box
-                        }
-
-                        if tipo == 'D':
-                            tokens = texto_sem_valor.split()
-                            if tokens:
-                                for t in reversed(tokens):
-                                    limpo = t.replace('.', '').replace('-', '')
-                                    if limpo.isdigit() and len(limpo) >= 4:
-                                        entry["Documento"] = limpar_documento_pdf(t)
-                                        break
-                            rows_debitos.append(entry)
-                        elif tipo == 'C':
-                            hist_upper = texto_sem_valor.upper()
-                            if any(x in hist_upper for x in ["TED DEVOLVIDA", "DEVOLUCAO DE TED", "TED DEVOL"]):
-                                rows_devolucoes.append(entry)
+        with fitz.open(stream=file_bytes, filetype="pdf") as doc_fitz:
+            n_paginas = doc_fitz.page_count
+        if paralelo is None: paralelo = N_PROCESSOS > 1 and n_paginas >= PAGINAS_MIN_PARALELO
+        
+        if paralelo: origem = extrair_lancamentos_pdf_paralelo(file_bytes, n_paginas, motor)
+        else: origem = extrair_lancamentos_pdf(file_bytes, motor)
+        
+        for tipo, entry in origem:
+            if tipo == 'D': rows_debitos.append(entry)
+            else: rows_devolucoes.append(entry)
                                 
         df_debitos = pd.DataFrame(rows_debitos)
         coords_referencia = rows_debitos + rows_devolucoes
@@ -156,6 +245,92 @@ def processar_pdf(file_bytes):
     
     return df, coords_referencia
 
+def comparar_motores_extracao(file_bytes):
+    # Paridade: roda os dois motores no mesmo extrato e lista as linhas/coordenadas que divergem
+    chaves = ['Data', 'Histórico', 'Documento', 'Valor_Extrato']
+    frames = []
+    for motor in MOTORES_EXTRACAO:
+        df = pd.DataFrame([entry for _, entry in extrair_lancamentos_pdf(file_bytes, motor)], columns=chaves + ['coords'])
+        df['Ocorrencia'] = df.groupby(chaves).cumcount()
+        frames.append(df)
+    
+    df_m = pd.merge(frames[0], frames[1], on=chaves + ['Ocorrencia'], how='outer', suffixes=('_a', '_b'), indicator=True)
+    
+    def desvio(ca, cb):
+        if not isinstance(ca, tuple) or not isinstance(cb, tuple): return 0.0 if ca == cb else float('inf')
+        if ca[0] != cb[0]: return float('inf')
+        return max(abs(x - y) for x, y in zip(ca[1:], cb[1:]))
+    
+    df_m['Desvio'] = [desvio(ca, cb) if m == 'both' else float('nan') for ca, cb, m in zip(df_m['coords_a'], df_m['coords_b'], df_m['_merge'])]
+    df_m['Divergência'] = df_m['_merge'].map({'left_only': f"Só {MOTORES_EXTRACAO[0]}", 'right_only': f"Só {MOTORES_EXTRACAO[1]}", 'both': 'Coordenadas'}).astype(str)
+    df_div = df_m[(df_m['_merge'] != 'both') | (df_m['Desvio'] > TOLERANCIA_COORDS)]
+    
+    resumo = {
+        f"Linhas {MOTORES_EXTRACAO[0]}": len(frames[0]), f"Linhas {MOTORES_EXTRACAO[1]}": len(frames[1]),
+        "Divergências": len(df_div),
+        "Desvio Máx. (pt)": df_m.loc[df_m['_merge'] == 'both', 'Desvio'].max() if (df_m['_merge'] == 'both').any() else 0.0
+    }
+    return resumo, df_div[chaves + ['Divergência', 'Desvio']].reset_index(drop=True)
+
+def parear_estornos(df_estornos, df_originais):
+    def numerar(df_parte):
+        chave = pd.DataFrame({'Data': df_parte['Data'], 'Centavos': valor_em_centavos(df_parte['Valor_Razao'])}, index=df_parte.index).dropna()
+        chave['Ocorrencia'] = chave.groupby(['Data', 'Centavos'], sort=False).cumcount()
+        return chave.rename_axis('Idx').reset_index()
+    
+    pares = numerar(df_estornos).merge(numerar(df_originais), on=['Data', 'Centavos', 'Ocorrencia'], suffixes=('_est', '_orig'))
+    return set(pares['Idx_orig'])
+
+def resolver_documentos(df_final, df_pdf_ref):
+    # Resolve o Documento de todas as linhas do razão de uma vez, por junções com o índice por data do extrato
+    nao_localizado = DOC_NAO_LOCALIZADO
+    dt = df_final['Data']
+    info_aa = df_final['Info_AA'].astype(str).str.upper()
+    info_ab = df_final['Info_AB'].astype(str).str.upper()
+    hist = df_pdf_ref['Histórico'].astype(str).str.upper()
+    
+    def doc_por_data(mask, manter='last'):
+        return df_pdf_ref[mask].drop_duplicates('Data', keep=manter).set_index('Data')['Documento']
+    
+    lookup_fundeb = doc_por_data(hist.str.contains("FUNDEB", regex=False))
+    lookup_pasep = doc_por_data(hist.str.contains("PASEP", regex=False))
+    lookup_rfb = doc_por_data(hist.str.contains("RETENÇÃO RFB|RETENCAO RFB"))
+    lookup_ded_geral = doc_por_data(hist.str.contains(r"DEDUÇÃO|DED\."), manter='first')
+    
+    # Índice (Data, número sem zeros à esquerda) -> Documento
+    docs_data = df_pdf_ref[['Data', 'Documento']].drop_duplicates()
+    docs_data = docs_data.assign(Chave=docs_data['Documento'].astype(str).str.lstrip('0')).drop_duplicates(['Data', 'Chave'], keep='last')
+    datas_tarifa = docs_data.loc[docs_data['Documento'] == "Tarifas Bancárias", 'Data']
+    
+    # Tokens numéricos do Info_AB, na ordem em que aparecem; vale o primeiro que existir no extrato da data
+    tokens = info_ab.rename_axis('Idx').str.extractall(r'([\d\.]+)')
+    doc_token = pd.Series(index=df_final.index, dtype=object)
+    if not tokens.empty:
+        tokens = tokens[0].str.replace('.', '', regex=False).str.lstrip('0').rename('Chave').reset_index()
+        tokens['Data'] = dt.loc[tokens['Idx']].values
+        achados = tokens.merge(docs_data, on=['Data', 'Chave']).sort_values(['Idx', 'match']).drop_duplicates('Idx')
+        doc_token = achados.set_index('Idx')['Documento'].reindex(df_final.index)
+    
+    condicoes = [
+        info_aa.str.contains("DED.FUNDEB", regex=False),
+        info_ab.str.contains("PASEP", regex=False),
+        info_ab.str.contains("PARCELAMENTO SIMPLIFICADO|PARCELAMENTO SIMPLICADO|PARCELAMENTO EXCEPCIONAL"),
+        info_aa.str.contains("DED.", regex=False) & dt.isin(lookup_ded_geral.index),
+        ~dt.isin(docs_data['Data']),
+        info_ab.str.contains("TARIFA", regex=False) & dt.isin(datas_tarifa),
+        doc_token.notna(),
+    ]
+    escolhas = [
+        dt.map(lookup_fundeb).fillna(nao_localizado),
+        dt.map(lookup_pasep).fillna(nao_localizado),
+        dt.map(lookup_rfb).fillna(nao_localizado),
+        dt.map(lookup_ded_geral),
+        "S/D",
+        "Tarifas Bancárias",
+        doc_token,
+    ]
+    return pd.Series(np.select([c.to_numpy() for c in condicoes], [np.asarray(e, dtype=object) for e in escolhas], default=nao_localizado), index=df_final.index)
+
 def processar_excel_detalhado(file_bytes, df_pdf_ref, is_csv=False):
     try:
         # Carregar DataFrame
@@ -215,124 +390,196 @@ def processar_excel_detalhado(file_bytes, df_pdf_ref, is_csv=False):
         df_estornos = df_filtered[mask_estorno].copy()
         df_originais = df_filtered[~mask_estorno].copy()
         
-        # Conjunto de índices a remover (inicia com TODOS os estornos)
-        indices_remover = set(df_estornos.index)
-        
-        # Conjunto para controlar quais originais já foram "anulados"
-        originais_anulados = set()
+        # 2. O k-ésimo estorno de um par (Data, Valor) anula o k-ésimo original do mesmo par
+        #    (equivale a cada estorno, em ordem, consumir o primeiro original livre)
+        indices_remover = set(df_estornos.index) | parear_estornos(df_estornos, df_originais)
         
-        # 2. Para cada estorno, procurar um "irmão" nos originais
-        for idx_est, row_est in df_estornos.iterrows():
-            valor_estorno = row_est['Valor_Razao']
-            data_estorno = row_est['Data'] # Ex: "21/01/2026"
-            
-            # Busca originais com mesmo VALOR e mesma DATA
-            cand = df_originais[
-                (df_originais['Data'] == data_estorno) & # Trava de Data
-                (abs(df_originais['Valor_Razao'] - valor_estorno) < 0.01) &
-                (~df_originais.index.isin(originais_anulados))
-            ]
-            
-            if not cand.empty:
-                # Encontrou correspondência Exata (Data + Valor)
-                idx_original = cand.index[0]
-                indices_remover.add(idx_original)   # Marca original para remoção
-                originais_anulados.add(idx_original) # Marca como usado
-                
         # 3. Remover linhas filtradas
         df_final = df_filtered.drop(list(indices_remover)).copy()
         
         # ==============================================================================
         
-        # Ajuste de Datas e Documentos
-        df_final['Data_dt'] = df_final['Data'].apply(parse_br_date)
+        # Ajuste de Datas e Documentos (cada data distinta é interpretada uma única vez)
+        codigos, datas_unicas = pd.factorize(df_final['Data'], use_na_sentinel=False)
+        df_final['Data_dt'] = pd.Series([parse_br_date(d) for d in datas_unicas], dtype='datetime64[ns]').take(codigos).values
         df_final = df_final.dropna(subset=['Data_dt'])
         df_final['Data'] = df_final['Data_dt'].dt.strftime('%d/%m/%Y')
         
-        lookup = {dt: {str(doc).lstrip('0'): doc for doc in g['Documento'].unique()} for dt, g in df_pdf_ref.groupby('Data')}
-        lookup_fundeb = {}
-        lookup_pasep = {}
-        lookup_rfb = {}
-        lookup_ded_geral = {}
-        
-        if not df_pdf_ref.empty:
-            for _, row in df_pdf_ref.iterrows():
-                dt = row['Data']
-                doc = row['Documento']
-                hist = str(row['Histórico']).upper()
-                if "FUNDEB" in hist: lookup_fundeb[dt] = doc
-                if "PASEP" in hist: lookup_pasep[dt] = doc
-                if "RETENÇÃO RFB" in hist or "RETENCAO RFB" in hist: lookup_rfb[dt] = doc
-                if "DEDUÇÃO" in hist or "DED." in hist:
-                    if dt not in lookup_ded_geral: lookup_ded_geral[dt] = doc
-        
-        def find_doc(row):
-            dt = row['Data']
-            info_aa = str(row['Info_AA']).upper()
-            info_ab = str(row['Info_AB']).upper()
-            txt_ab = info_ab
-            if "DED.FUNDEB" in info_aa: return lookup_fundeb.get(dt, "NÃO LOCALIZADO")
-            if "PASEP" in info_ab: return lookup_pasep.get(dt, "NÃO LOCALIZADO")
-            if any(t in info_ab for t in ["PARCELAMENTO SIMPLIFICADO", "PARCELAMENTO SIMPLICADO", "PARCELAMENTO EXCEPCIONAL"]):
-                return lookup_rfb.get(dt, "NÃO LOCALIZADO")
-            if "DED." in info_aa:
-                if dt in lookup_ded_geral: return lookup_ded_geral[dt]
-            if dt not in lookup: return "S/D"
-            if "TARIFA" in txt_ab and "Tarifas Bancárias" in lookup[dt].values(): return "Tarifas Bancárias"
-            
-            for token in re.findall(r'[\d\.]+', txt_ab):
-                clean_n = token.replace('.', '')
-                if clean_n.lstrip('0') in lookup[dt]: 
-                    return lookup[dt][clean_n.lstrip('0')]
-            
-            return "NÃO LOCALIZADO"
-            
-        df_final['Documento'] = df_final.apply(find_doc, axis=1)
+        df_final['Documento'] = resolver_documentos(df_final, df_pdf_ref)
         return df_final[['Data', 'Documento', 'Valor_Razao', 'Lancamento']]
         
     except Exception as e:
         return pd.DataFrame()
 
+def indexar_razao(df_excel):
+    # Índices montados uma única vez: (Data, Documento, centavos) e (Data, centavos) -> posições em ordem
+    idx_exato, idx_valor = {}, {}
+    centavos = valor_em_centavos(df_excel['Valor_Razao'])
+    for pos, (dt, doc, cent) in enumerate(zip(df_excel['Data'], df_excel['Documento'], centavos)):
+        if pd.isna(cent): continue
+        cent = int(cent)
+        idx_exato.setdefault((dt, doc, cent), deque()).append(pos)
+        idx_valor.setdefault((dt, cent), deque()).append(pos)
+    return idx_exato, idx_valor
+
+def consumir_primeiro_livre(fila, usados):
+    while fila:
+        pos = fila.popleft()
+        if not usados[pos]: return pos
+    return None
+
+def buscar_subconjunto(alvo, pool, prazo):
+    # pool: [(centavos, posição)] em ordem decrescente de valor; busca em profundidade com poda.
+    # Só devolve as posições quando a combinação de valores (até LIMITE_ITENS_AGRUPAMENTO itens) é a única que
+    # fecha o alvo; mais de uma, ou prazo esgotado antes de provar que é única, deixa o débito como divergência.
+    valores = [c for c, _ in pool]
+    prefixo = [0]
+    for v in valores: prefixo.append(prefixo[-1] + v)
+    escolha = []
+    solucoes = []
+    nos = 0
+    estourou = False
+
+    def dfs(inicio, falta):
+        nonlocal nos, estourou
+        if falta == 0:
+            solucoes.append(list(escolha))
+            return len(solucoes) > 1
+        restam = LIMITE_ITENS_AGRUPAMENTO - len(escolha)
+        # Com os valores em ordem decrescente, os próximos "restam" itens são o máximo alcançável
+        if estourou or restam == 0 or prefixo[min(inicio + restam, len(valores))] - prefixo[inicio] < falta: return False
+        nos += 1
+        if nos % 512 == 0 and time.perf_counter() > prazo:
+            estourou = True
+            return False
+        anterior = None
+        for i in range(inicio, len(valores)):
+            v = valores[i]
+            if v > falta or v == anterior: continue
+            if prefixo[min(i + restam, len(valores))] - prefixo[i] < falta: break
+            anterior = v
+            escolha.append(i)
+            if dfs(i + 1, falta - v): return True
+            escolha.pop()
+        return False
+
+    if alvo <= 0: return None
+    dfs(0, alvo)
+    if estourou or len(solucoes) != 1: return None
+    return [pool[i][1] for i in solucoes[0]]
+
+def agrupar_por_soma(df_pdf, df_excel, usados_p, usados_e):
+    # Um débito do extrato x vários lançamentos do razão na MESMA data (centavos inteiros)
+    cent_p = valor_em_centavos(df_pdf['Valor_Extrato'])
+    cent_e = valor_em_centavos(df_excel['Valor_Razao'])
+    
+    # Grupos (Data, Documento) que já fecham na consolidação ficam de fora
+    sobras_p = pd.DataFrame({'Data': df_pdf['Data'].values, 'Documento': df_pdf['Documento'].values, 'Centavos': cent_p.values})[~usados_p]
+    sobras_e = pd.DataFrame({'Data': df_excel['Data'].values, 'Documento': df_excel['Documento'].values, 'Centavos': cent_e.values})[~usados_e]
+    soma_p = sobras_p.groupby(['Data', 'Documento'])['Centavos'].sum()
+    soma_e = sobras_e.groupby(['Data', 'Documento'])['Centavos'].sum()
+    comuns = soma_p.index.intersection(soma_e.index)
+    fechados = set(k for k in comuns if soma_p[k] == soma_e[k])
+    
+    # Candidatos do razão: documento não localizado ou diferente de todos os documentos que sobraram no extrato
+    # na data (lançamento com o documento de um débito do extrato pertence a esse débito, não a um agrupamento)
+    docs_extrato = set(zip(sobras_p['Data'], sobras_p['Documento']))
+    pools = {}
+    for pos, (dt, doc, cent) in enumerate(zip(df_excel['Data'], df_excel['Documento'], cent_e)):
+        if usados_e[pos] or pd.isna(cent) or cent <= 0 or (dt, doc) in fechados: continue
+        if doc != DOC_NAO_LOCALIZADO and (dt, doc) in docs_extrato: continue
+        pools.setdefault(dt, []).append((int(cent), pos))
+    for dt in pools: pools[dt].sort(key=lambda x: (-x[0], x[1]))
+    
+    alvos = {}
+    for pos, (dt, doc, cent) in enumerate(zip(df_pdf['Data'], df_pdf['Documento'], cent_p)):
+        if usados_p[pos] or pd.isna(cent) or cent <= 0 or (dt, doc) in fechados or dt not in pools: continue
+        alvos.setdefault(dt, []).append((int(cent), pos))
+    
+    pares = []
+    for dt, lista in alvos.items():
+        prazo = time.perf_counter() + TEMPO_LIMITE_AGRUPAMENTO_DIA
+        for cent, pos_p in lista:
+            pool = pools[dt]
+            if len(pool) < 2 or time.perf_counter() > prazo: break
+            # Combinações possíveis / valores possíveis até o alvo: com muitos candidatos, uma soma exata
+            # (mesmo única) é provável por coincidência e o débito fica como divergência
+            n = sum(1 for c, _ in pool if c < cent)
+            if sum(math.comb(n, k) for k in range(2, LIMITE_ITENS_AGRUPAMENTO + 1)) > LIMITE_ACASO_AGRUPAMENTO * cent: continue
+            achados = buscar_subconjunto(cent, pool, prazo)
+            if achados:
+                pares.append((pos_p, achados))
+                usados_p[pos_p] = True
+                usados_e[achados] = True
+                pools[dt] = [item for item in pool if not usados_e[item[1]]]
+    return pares
+
 def executar_conciliacao_inteligente(df_pdf, df_excel):
     res = []
-    idx_p_u, idx_e_u = set(), set()
+    usados_p = np.zeros(len(df_pdf), dtype=bool)
+    usados_e = np.zeros(len(df_excel), dtype=bool)
+    
+    idx_exato, idx_valor = indexar_razao(df_excel)
+    cent_pdf = valor_em_centavos(df_pdf['Valor_Extrato']).tolist()
+    datas_p = df_pdf['Data'].tolist()
+    docs_p = df_pdf['Documento'].tolist()
+    hists_p = df_pdf['Histórico'].tolist()
+    vals_p = df_pdf['Valor_Extrato'].tolist()
+    lancs_e = df_excel['Lancamento'].tolist()
+    vals_e = df_excel['Valor_Razao'].tolist()
     
     # 1. MATCH EXATO
-    for idx_p, row_p in df_pdf.iterrows():
-        cand = df_excel[(df_excel['Data'] == row_p['Data']) & (df_excel['Documento'] == row_p['Documento']) & (~df_excel.index.isin(idx_e_u))]
-        m = cand[abs(cand['Valor_Razao'] - row_p['Valor_Extrato']) < 0.01]
-        if not m.empty:
-            idx_e = m.index[0]
-            row_e = m.loc[idx_e]
+    for pos_p in range(len(df_pdf)):
+        if pd.isna(cent_pdf[pos_p]): continue
+        fila = idx_exato.get((datas_p[pos_p], docs_p[pos_p], int(cent_pdf[pos_p])))
+        pos_e = consumir_primeiro_livre(fila, usados_e) if fila else None
+        if pos_e is not None:
             res.append({
-                'Data': row_p['Data'], 'Histórico': row_p['Histórico'], 'Documento': row_p['Documento'], 
-                'Lancamento': row_e['Lancamento'], # Pega do Excel
-                'Valor_Extrato': row_p['Valor_Extrato'], 'Valor_Razao': row_e['Valor_Razao'], 
+                'Data': datas_p[pos_p], 'Histórico': hists_p[pos_p], 'Documento': docs_p[pos_p], 
+                'Lancamento': lancs_e[pos_e], # Pega do Excel
+                'Valor_Extrato': vals_p[pos_p], 'Valor_Razao': vals_e[pos_e], 
                 'Diferença': 0.0, 'Tipo': 'Mestre',
-                'Sort_Data': row_p['Data'], 'Sort_Doc': row_p['Documento'], 'Order_Idx': 0
+                'Sort_Data': datas_p[pos_p], 'Sort_Doc': docs_p[pos_p], 'Order_Idx': 0
             })
-            idx_p_u.add(idx_p); idx_e_u.add(idx_e)
+            usados_p[pos_p] = True; usados_e[pos_e] = True
             
     # 2. MATCH POR VALOR
-    for idx_p, row_p in df_pdf.iterrows():
-        if idx_p in idx_p_u: continue
-        cand = df_excel[(df_excel['Data'] == row_p['Data']) & (~df_excel.index.isin(idx_e_u))]
-        m = cand[abs(cand['Valor_Razao'] - row_p['Valor_Extrato']) < 0.01]
-        if not m.empty:
-            idx_e = m.index[0]
-            row_e = m.loc[idx_e]
+    for pos_p in range(len(df_pdf)):
+        if usados_p[pos_p] or pd.isna(cent_pdf[pos_p]): continue
+        fila = idx_valor.get((datas_p[pos_p], int(cent_pdf[pos_p])))
+        pos_e = consumir_primeiro_livre(fila, usados_e) if fila else None
+        if pos_e is not None:
             res.append({
-                'Data': row_p['Data'], 'Histórico': row_p['Histórico'], 'Documento': "Docs dif.", 
-                'Lancamento': row_e['Lancamento'],
-                'Valor_Extrato': row_p['Valor_Extrato'], 'Valor_Razao': row_e['Valor_Razao'], 
+                'Data': datas_p[pos_p], 'Histórico': hists_p[pos_p], 'Documento': "Docs dif.", 
+                'Lancamento': lancs_e[pos_e],
+                'Valor_Extrato': vals_p[pos_p], 'Valor_Razao': vals_e[pos_e], 
                 'Diferença': 0.0, 'Tipo': 'Mestre',
-                'Sort_Data': row_p['Data'], 'Sort_Doc': "Docs dif.", 'Order_Idx': 0
+                'Sort_Data': datas_p[pos_p], 'Sort_Doc': "Docs dif.", 'Order_Idx': 0
             })
-            idx_p_u.add(idx_p); idx_e_u.add(idx_e)
+            usados_p[pos_p] = True; usados_e[pos_e] = True
             
-    # 3. CONSOLIDAÇÃO DE SOBRAS (COM DETALHAMENTO)
-    df_p_sobras = df_pdf[~df_pdf.index.isin(idx_p_u)].copy()
-    df_e_sobras = df_excel[~df_excel.index.isin(idx_e_u)].copy()
+    # 3. AGRUPAMENTO POR SOMA (1 DÉBITO x N LANÇAMENTOS NA MESMA DATA)
+    for n_grupo, (pos_p, posicoes_e) in enumerate(agrupar_por_soma(df_pdf, df_excel, usados_p, usados_e)):
+        chave_sort = f"Docs agrup. {n_grupo:05d}"
+        res.append({
+            'Data': datas_p[pos_p], 'Histórico': hists_p[pos_p], 'Documento': "Docs agrup.",
+            'Lancamento': '-',
+            'Valor_Extrato': vals_p[pos_p], 'Valor_Razao': sum(vals_e[i] for i in posicoes_e),
+            'Diferença': 0.0, 'Tipo': 'Mestre',
+            'Sort_Data': datas_p[pos_p], 'Sort_Doc': chave_sort, 'Order_Idx': 0
+        })
+        for order_idx, pos_e in enumerate(posicoes_e, start=1):
+            res.append({
+                'Data': '', 'Histórico': '', 'Documento': '',
+                'Lancamento': lancs_e[pos_e],
+                'Valor_Extrato': '-', 'Valor_Razao': vals_e[pos_e],
+                'Diferença': 0.0, 'Tipo': 'Detalhe',
+                'Sort_Data': datas_p[pos_p], 'Sort_Doc': chave_sort, 'Order_Idx': order_idx
+            })
+            
+    # 4. CONSOLIDAÇÃO DE SOBRAS (COM DETALHAMENTO)
+    df_p_sobras = df_pdf.iloc[~usados_p].copy()
+    df_e_sobras = df_excel.iloc[~usados_e].copy()
 
     # Agrupamento PDF
     if not df_p_sobras.empty:
@@ -409,6 +656,101 @@ def executar_conciliacao_inteligente(df_pdf, df_excel):
     
     return df_sorted
 
+# --- CACHE EM DISCO (PARQUET) ---
+def chave_conciliacao(*partes):
+    # Hash dos arquivos de entrada + parâmetros da conciliação
+    h = hashlib.sha256()
+    for parte in partes:
+        h.update(parte if isinstance(parte, bytes) else str(parte).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+def serializar_colunas(df):
+    # Parquet exige um tipo por coluna: separa textos ('-') de valores e abre as tuplas de coordenadas
+    df = df.copy()
+    for col in list(df.columns[df.dtypes == object]):
+        e_tupla = df[col].map(lambda v: isinstance(v, tuple))
+        if e_tupla.any():
+            partes = pd.DataFrame([v if t else (np.nan,) * 5 for v, t in zip(df[col], e_tupla)], index=df.index, dtype=float)
+            df[col] = partes[0]
+            for i in range(1, partes.shape[1]): df[f"{col}#{i}"] = partes[i]
+            continue
+        e_texto = df[col].map(lambda v: isinstance(v, str))
+        if not e_texto.all():
+            df[f"{col}#txt"] = df[col].where(e_texto)
+            df[col] = pd.to_numeric(df[col].where(~e_texto))
+    return df
+
+def restaurar_colunas(df):
+    for col in [c for c in df.columns if c.endswith('#txt')]:
+        base = col[:-4]
+        df[base] = df[base].astype(object).where(df[col].isna(), df[col])
+        df = df.drop(columns=col)
+    for col in [c for c in df.columns if c.endswith('#1')]:
+        base = col[:-2]
+        extras = [f"{base}#{i}" for i in range(1, 5)]
+        df[base] = [(int(p), *r) if not pd.isna(p) else None for p, *r in zip(df[base], *(df[c] for c in extras))]
+        df = df.drop(columns=extras)
+    return df
+
+def cache_ler(chave, nomes):
+    pasta = os.path.join(CACHE_DIR, chave)
+    try:
+        dfs = [restaurar_colunas(pd.read_parquet(os.path.join(pasta, f"{n}.parquet"))) for n in nomes]
+        os.utime(pasta)  # mtime = último uso (LRU)
+        return dfs
+    except Exception:
+        return None
+
+def cache_gravar(chave, **dfs):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=CACHE_DIR, prefix=".tmp_")
+        for nome, df in dfs.items():
+            serializar_colunas(df).to_parquet(os.path.join(tmp, f"{nome}.parquet"))
+        destino = os.path.join(CACHE_DIR, chave)
+        if os.path.isdir(destino): shutil.rmtree(tmp)
+        else: os.rename(tmp, destino)
+        limpar_cache()
+    except Exception:
+        pass
+
+def limpar_cache(limite=CACHE_LIMITE_BYTES):
+    entradas = []
+    for nome in os.listdir(CACHE_DIR):
+        pasta = os.path.join(CACHE_DIR, nome)
+        if nome.startswith('.') or not os.path.isdir(pasta): continue
+        tamanho = sum(e.stat().st_size for e in os.scandir(pasta))
+        entradas.append((os.path.getmtime(pasta), tamanho, pasta))
+    total = sum(t for _, t, _ in entradas)
+    for _, tamanho, pasta in sorted(entradas):
+        if total <= limite: break
+        shutil.rmtree(pasta, ignore_errors=True)
+        total -= tamanho
+
+def conciliar_com_cache(pdf_bytes, xlsx_bytes, is_csv=False, motor="pdfplumber", paralelo=None):
+    # Chaves: SHA-256 da versão do cache + extrato (+ motor) e + os dois arquivos (+ parâmetros)
+    chave_pdf = chave_conciliacao(VERSAO_CACHE, pdf_bytes, motor)
+    chave = chave_conciliacao(VERSAO_CACHE, pdf_bytes, xlsx_bytes, is_csv, motor)
+    
+    em_cache = cache_ler(chave_pdf, ['df_p', 'coords'])
+    if em_cache:
+        df_p, df_coords = em_cache
+        coords_ref = df_coords.to_dict('records')
+    else:
+        df_p, coords_ref = processar_pdf(pdf_bytes, paralelo=paralelo, motor=motor)
+        if not df_p.empty: cache_gravar(chave_pdf, df_p=df_p, coords=pd.DataFrame(coords_ref))
+    
+    em_cache = cache_ler(chave, ['df_e', 'df_f'])
+    if em_cache:
+        df_e, df_f = em_cache
+    else:
+        df_e = processar_excel_detalhado(xlsx_bytes, df_p, is_csv=is_csv)
+        if df_p.empty or df_e.empty: return chave, df_p, df_e, None, coords_ref
+        df_f = executar_conciliacao_inteligente(df_p, df_e)
+        cache_gravar(chave, df_e=df_e, df_f=df_f)
+    return chave, df_p, df_e, df_f, coords_ref
+
 # ==============================================================================
 # 2. GERAÇÃO DE SAÍDAS (PDF, EXCEL E MARCAÇÃO)
 # ==============================================================================
@@ -493,90 +835,340 @@ def gerar_pdf_final(df_f, titulo_completo):
 
 def gerar_excel_final(df_f):
     output = io.BytesIO()
+    # constant_memory: cada linha vai para o disco assim que a próxima começa (memória estável)
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    escrever_aba_conciliacao(workbook, criar_formatos_excel(workbook), df_f, 'Conciliacao')
+    workbook.close()
+    return output.getvalue()
+
+def criar_formatos_excel(workbook):
+    # Conjunto fixo de formatos, criado uma vez por arquivo
+    return {
+        'header': workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1, 'align': 'center', 'valign': 'vcenter'}),
+        'currency': workbook.add_format({'num_format': '#,##0.00'}),
+        'red_bold': workbook.add_format({'font_color': '#FF0000', 'bold': True, 'num_format': '#,##0.00'}),
+        'detalhe': workbook.add_format({'font_color': '#000000', 'bg_color': '#F2F2F2', 'italic': True, 'num_format': '#,##0.00', 'font_size': 9, 'border': 1}),
+        'detalhe_txt': workbook.add_format({'font_color': '#000000', 'bg_color': '#F2F2F2', 'italic': True, 'font_size': 9, 'border': 1}),
+        'total': workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'num_format': '#,##0.00', 'border': 1}),
+        'total_label': workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1, 'align': 'center'}),
+    }
+
+def escrever_aba_conciliacao(workbook, fmt, df_f, nome_aba):
+    worksheet = workbook.add_worksheet(nome_aba)
+    
+    worksheet.set_column('A:A', 12) # Data
+    worksheet.set_column('B:B', 30) # Historico
+    worksheet.set_column('C:C', 15) # Documento
+    worksheet.set_column('D:D', 12) # Lancamento
+    worksheet.set_column('E:F', 18, fmt['currency']) # Valores
+    worksheet.set_column('G:G', 18, fmt['currency']) # Diferenca
     
-    df_export = df_f.copy()
-    
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df_export.to_excel(writer, sheet_name='Conciliacao', index=False)
-        
-        workbook = writer.book
-        worksheet = writer.sheets['Conciliacao']
-        
-        fmt_header = workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1, 'align': 'center', 'valign': 'vcenter'})
-        fmt_currency = workbook.add_format({'num_format': '#,##0.00'})
-        fmt_red_bold = workbook.add_format({'font_color': '#FF0000', 'bold': True, 'num_format': '#,##0.00'})
-        
-        fmt_detalhe = workbook.add_format({'font_color': '#000000', 'bg_color': '#F2F2F2', 'italic': True, 'num_format': '#,##0.00', 'font_size': 9, 'border': 1})
-        fmt_detalhe_txt = workbook.add_format({'font_color': '#000000', 'bg_color': '#F2F2F2', 'italic': True, 'font_size': 9, 'border': 1})
-        
-        fmt_total = workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'num_format': '#,##0.00', 'border': 1})
-        fmt_total_label = workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1, 'align': 'center'})
-
-        for col_num, value in enumerate(df_export.columns.values):
-            worksheet.write(0, col_num, value, fmt_header)
-
-        worksheet.set_column('A:A', 12) # Data
-        worksheet.set_column('B:B', 30) # Historico
-        worksheet.set_column('C:C', 15) # Documento
-        worksheet.set_column('D:D', 12) # Lancamento
-        worksheet.set_column('E:F', 18, fmt_currency) # Valores
-        worksheet.set_column('G:G', 18, fmt_currency) # Diferenca
-        
-        for i, row in df_export.iterrows():
-            excel_row = i + 1
-            if row['Tipo'] == 'Detalhe':
-                worksheet.set_row(excel_row, 10)
-                worksheet.write(excel_row, 0, row['Data'], fmt_detalhe_txt)
-                worksheet.write(excel_row, 1, row['Histórico'], fmt_detalhe_txt)
-                worksheet.write(excel_row, 2, row['Documento'], fmt_detalhe_txt)
-                worksheet.write(excel_row, 3, row['Lancamento'], fmt_detalhe_txt)
-                
-                val_ext = row['Valor_Extrato']
-                val_raz = row['Valor_Razao']
-                
-                if val_ext == '-': worksheet.write(excel_row, 4, '-', fmt_detalhe)
-                else: worksheet.write(excel_row, 4, val_ext, fmt_detalhe)
-                
-                if val_raz == '-': worksheet.write(excel_row, 5, '-', fmt_detalhe)
-                else: worksheet.write(excel_row, 5, val_raz, fmt_detalhe)
-                
-                worksheet.write(excel_row, 6, '', fmt_detalhe)
-            else:
-                if abs(row['Diferença']) >= 0.01:
-                       worksheet.write(excel_row, 6, row['Diferença'], fmt_red_bold)
-
-        df_mestre = df_export[df_export['Tipo'] == 'Mestre']
-        last_row = len(df_export) + 1
-        worksheet.merge_range(last_row, 0, last_row, 3, "TOTAL", fmt_total_label)
-        worksheet.write(last_row, 4, df_mestre['Valor_Extrato'].sum(), fmt_total)
-        worksheet.write(last_row, 5, df_mestre['Valor_Razao'].sum(), fmt_total)
-        worksheet.write(last_row, 6, df_mestre['Diferença'].sum(), fmt_total)
+    worksheet.write_row(0, 0, list(df_f.columns), fmt['header'])
+    
+    # Linhas inteiras, em ordem (exigência do constant_memory); vazios viram células em branco
+    col_dif = df_f.columns.get_loc('Diferença')
+    linhas = df_f.astype(object).where(df_f.notna(), '').values.tolist()
+    for excel_row, (linha, tipo) in enumerate(zip(linhas, df_f['Tipo']), start=1):
+        if tipo == 'Detalhe':
+            linha[col_dif] = ''
+            worksheet.set_row(excel_row, 10)
+            worksheet.write_row(excel_row, 0, linha[:4], fmt['detalhe_txt'])
+            worksheet.write_row(excel_row, 4, linha[4:col_dif + 1], fmt['detalhe'])
+            worksheet.write_row(excel_row, col_dif + 1, linha[col_dif + 1:])
+        else:
+            dif = linha[col_dif]
+            if abs(dif) >= 0.01: linha[col_dif] = ''
+            worksheet.write_row(excel_row, 0, linha)
+            if abs(dif) >= 0.01: worksheet.write(excel_row, col_dif, dif, fmt['red_bold'])
 
-    return output.getvalue()
+    df_mestre = df_f[df_f['Tipo'] == 'Mestre']
+    last_row = len(df_f) + 1
+    worksheet.merge_range(last_row, 0, last_row, 3, "TOTAL", fmt['total_label'])
+    worksheet.write_row(last_row, 4, [df_mestre['Valor_Extrato'].sum(), df_mestre['Valor_Razao'].sum(), df_mestre['Diferença'].sum()], fmt['total'])
 
 def gerar_extrato_marcado(pdf_bytes, df_f, coords_referencia, nome_original):
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    meta = doc.metadata
-    meta["title"] = f"{nome_original} Marcado"
-    doc.set_metadata(meta)
+    # Índice (Data, centavos) -> caixas do valor no extrato
+    idx_coords = {}
+    for item in coords_referencia:
+        if isinstance(item['coords'], tuple):
+            idx_coords.setdefault((item['Data'], round(item['Valor_Extrato'] * 100)), []).append(item['coords'])
     
     divergencias = df_f[(df_f['Tipo'] == 'Mestre') & (abs(df_f['Diferença']) >= 0.01)]
     
-    for _, erro in divergencias.iterrows():
-        for item in coords_referencia:
-            if item['Data'] == erro['Data'] and abs(item['Valor_Extrato'] - erro['Valor_Extrato']) < 0.01:
-                if item['coords']:
-                    pno, x0, top, x1, bottom = item['coords']
-                    page = doc[pno]
-                    rect = fitz.Rect(x0 - 2, top - 2, x1 + 2, bottom + 2)
-                    annot = page.add_highlight_annot(rect)
-                    annot.set_colors(stroke=[1, 1, 0])
-                    annot.update()
+    # Caixas agrupadas por página (sem repetir a mesma caixa)
+    rects_por_pagina = {}
+    for dt, cent in zip(divergencias['Data'], valor_em_centavos(divergencias['Valor_Extrato'])):
+        if pd.isna(cent): continue
+        for pno, x0, top, x1, bottom in idx_coords.get((dt, int(cent)), []):
+            rects_por_pagina.setdefault(pno, {})[(x0, top, x1, bottom)] = None
+    
+    # O extrato vai para um arquivo temporário para que as marcações sejam gravadas de forma incremental
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(pdf_bytes)
+    try:
+        doc = fitz.open(tmp.name)
+        meta = doc.metadata
+        meta["title"] = f"{nome_original} Marcado"
+        doc.set_metadata(meta)
+        
+        for pno in sorted(rects_por_pagina):
+            rects = [fitz.Rect(x0 - 2, top - 2, x1 + 2, bottom + 2) for x0, top, x1, bottom in rects_por_pagina[pno]]
+            page = doc[pno]
+            annot = page.add_highlight_annot(quads=rects)  # Uma anotação por página
+            annot.set_colors(stroke=[1, 1, 0])
+            annot.update()
+        
+        if doc.can_save_incrementally():
+            doc.saveIncr()
+            doc.close()
+            with open(tmp.name, "rb") as f: return f.read()
+        saida = doc.tobytes()
+        doc.close()
+        return saida
+    finally:
+        os.remove(tmp.name)
+
+@st.cache_data(show_spinner=False, max_entries=30)
+def gerar_artefato(chave, tipo, nome_base, _resultado):
+    # Gerado só quando o download é pedido; argumentos com "_" não entram no hash. A chave identifica a entrada
+    # e nome_base entra à parte porque vai nos títulos dos relatórios
+    if tipo == 'pdf': return gerar_pdf_final(_resultado['df_f'], f"Conciliação {nome_base}")
+    if tipo == 'excel': return gerar_excel_final(_resultado['df_f'])
+    return gerar_extrato_marcado(_resultado['pdf_bytes'], _resultado['df_f'], _resultado['coords_ref'], nome_base)
+
+def filtrar_resultado(df_f, somente_divergencias=False, periodo=None, documento=""):
+    # Filtra pelos lançamentos Mestre e leva junto as linhas de Detalhe de cada um
+    grupo = (df_f['Tipo'] == 'Mestre').cumsum()
+    mestres = df_f[df_f['Tipo'] == 'Mestre']
+    mask = pd.Series(True, index=mestres.index)
+    if somente_divergencias:
+        mask &= mestres['Diferença'].abs() >= 0.01
+    if periodo:
+        datas = pd.to_datetime(mestres['Data'], format='%d/%m/%Y', errors='coerce')
+        mask &= (datas >= pd.Timestamp(periodo[0])) & (datas <= pd.Timestamp(periodo[1]))
+    if documento:
+        mask &= mestres['Documento'].astype(str).str.contains(documento, case=False, regex=False, na=False)
+    return df_f[grupo.isin(grupo[mestres.index[mask]])]
+
+def paginar_resultado(df_view, pagina, por_pagina=LINHAS_POR_PAGINA):
+    grupo = (df_view['Tipo'] == 'Mestre').cumsum()
+    inicio = (pagina - 1) * por_pagina
+    return df_view[(grupo > inicio) & (grupo <= inicio + por_pagina)]
+
+def gerar_tabela_html(df_pagina, df_totais):
+    html = ["<div style='background-color: white; padding: 15px; border-radius: 5px; border: 1px solid #ddd;'>"]
+    html.append("<table style='width:100%; border-collapse: collapse; color: black !important; background-color: white !important; font-family: Arial, sans-serif;'>")
+    html.append("<tr style='background-color: black; color: white !important;'>")
+    for titulo in ["Data", "Lançamento", "Histórico", "Documento", "Vlr. Extrato", "Vlr. Razão", "Diferença"]:
+        html.append(f"<th style='padding: 8px; border: 1px solid #000;'>{titulo}</th>")
+    html.append("</tr>")
+    
+    style_row = "background-color: #f2f2f2; color: #000; font-size: 11px; line-height: 1.0;"
+    style_cell = "padding: 2px 8px; border: 1px solid #000;"
+    for r in df_pagina.to_dict('records'):
+        if r['Tipo'] == 'Detalhe':
+            html.append(f"<tr style='{style_row}'>")
+            html.append(f"<td style='{style_cell} text-align: center;'></td>")
+            html.append(f"<td style='{style_cell} text-align: center;'>{r['Lancamento']}</td>")
+            html.append(f"<td style='{style_cell} font-size: 11px;'></td>")
+            html.append(f"<td style='{style_cell}'></td>")
+            html.append(f"<td style='{style_cell} text-align: right;'>{formatar_moeda_br(r['Valor_Extrato'])}</td>")
+            html.append(f"<td style='{style_cell} text-align: right;'>{formatar_moeda_br(r['Valor_Razao'])}</td>")
+            html.append(f"<td style='{style_cell}'></td></tr>")
+        else:
+            estilo_dif = "color: red; font-weight: bold;" if abs(r['Diferença']) >= 0.01 else "color: black;"
+            html.append("<tr style='background-color: white;'>")
+            html.append(f"<td style='text-align: center; border: 1px solid #000; color: black;'>{r['Data']}</td>")
+            html.append(f"<td style='text-align: center; border: 1px solid #000; color: black;'>{r['Lancamento']}</td>")
+            html.append(f"<td style='text-align: left; border: 1px solid #000; color: black; font-size: 11px;'>{r['Histórico']}</td>")
+            html.append(f"<td style='text-align: center; border: 1px solid #000; color: black;'>{r['Documento']}</td>")
+            html.append(f"<td style='text-align: right; border: 1px solid #000; color: black;'>{formatar_moeda_br(r['Valor_Extrato'])}</td>")
+            html.append(f"<td style='text-align: right; border: 1px solid #000; color: black;'>{formatar_moeda_br(r['Valor_Razao'])}</td>")
+            html.append(f"<td style='text-align: right; border: 1px solid #000; {estilo_dif}'>{formatar_moeda_br(r['Diferença']) if abs(r['Diferença']) >= 0.01 else '-'}</td></tr>")
     
-    return doc.tobytes()
+    df_mestre = df_totais[df_totais['Tipo'] == 'Mestre']
+    html.append("<tr style='font-weight: bold; background-color: lightgrey; color: black;'><td colspan='4' style='padding: 10px; text-align: center; border: 1px solid #000;'>TOTAL</td>")
+    html.append(f"<td style='text-align: right; border: 1px solid #000;'>{formatar_moeda_br(df_mestre['Valor_Extrato'].sum())}</td>")
+    html.append(f"<td style='text-align: right; border: 1px solid #000;'>{formatar_moeda_br(df_mestre['Valor_Razao'].sum())}</td>")
+    html.append(f"<td style='text-align: right; border: 1px solid #000;'>{formatar_moeda_br(df_mestre['Diferença'].sum())}</td></tr></table></div>")
+    return "".join(html)
 
 # ==============================================================================
-# 3. INTERFACE
+# 3. CONCILIAÇÃO EM LOTE (VÁRIAS CONTAS)
+# ==============================================================================
+
+EXTENSOES_LOTE = ('.pdf', '.xlsx', '.csv')
+
+def ler_arquivos_lote(nome, file_bytes):
+    # Lê os membros do .zip/.rar direto da memória, sem extrair para disco
+    nome_l = nome.lower()
+    if nome_l.endswith(EXTENSOES_LOTE):
+        return [(os.path.basename(nome), file_bytes)]
+    if nome_l.endswith('.rar'): arq = rarfile.RarFile(io.BytesIO(file_bytes))
+    elif nome_l.endswith('.zip'): arq = zipfile.ZipFile(io.BytesIO(file_bytes))
+    else: return []
+    with arq:
+        membros = []
+        for info in arq.infolist():
+            base = os.path.basename(info.filename)
+            if info.is_dir() or base.startswith(('.', '~$')) or not base.lower().endswith(EXTENSOES_LOTE): continue
+            membros.append((base, arq.read(info)))
+        return membros
+
+# Datas no nome do arquivo (dd.mm.aaaa, aaaa-mm-dd, mm-aaaa) não são número de conta
+PADRAO_DATA_NOME = re.compile(
+    r'(?<!\d)(?:(?:0[1-9]|[12]\d|3[01])[\.\-/](?:0[1-9]|1[0-2])[\.\-/](?:19|20)\d{2}'
+    r'|(?:19|20)\d{2}[\.\-/](?:0[1-9]|1[0-2])[\.\-/](?:0[1-9]|[12]\d|3[01])'
+    r'|(?:0[1-9]|1[0-2])[\.\-/](?:19|20)\d{2})(?!\d)'
+)
+
+def normalizar_conta(texto):
+    # Maior sequência numérica (pontos e traços removidos), sem zeros à esquerda, ignorando as datas
+    texto = PADRAO_DATA_NOME.sub(' ', str(texto))
+    candidatos = [re.sub(r'[\.\-]', '', t).lstrip('0') for t in re.findall(r'\d[\d\.\-]*\d', texto)]
+    candidatos = [c for c in candidatos if len(c) >= 4]
+    return max(candidatos, key=len) if candidatos else None
+
+def extrair_conta(nome, file_bytes):
+    conta = normalizar_conta(os.path.splitext(nome)[0])
+    if conta: return conta
+    # Sem dígitos no nome: procura "Conta ..." no conteúdo
+    try:
+        if nome.lower().endswith('.pdf'):
+            with fitz.open(stream=file_bytes, filetype="pdf") as doc:
+                texto = doc[0].get_text() if doc.page_count else ""
+        elif nome.lower().endswith('.csv'):
+            texto = file_bytes[:4096].decode('latin1')
+        else:
+            texto = " ".join(pd.read_excel(io.BytesIO(file_bytes), header=None, nrows=10).astype(str).values.ravel())
+    except: return None
+    m = re.search(r'Conta[^\d]{0,20}(\d[\d\.\-]{3,}\d)', texto, re.IGNORECASE)
+    return normalizar_conta(m.group(1)) if m else None
+
+def contas_equivalentes(a, b):
+    # Igual, sufixo (agência/prefixo a mais) ou apenas o dígito verificador faltando
+    if a == b: return True
+    curta, longa = sorted((a, b), key=len)
+    return longa.endswith(curta) or longa[:-1] == curta
+
+def parear_arquivos_lote(arquivos):
+    extratos, razoes, sem_conta = {}, {}, []
+    for nome, dados in sorted(arquivos, key=lambda x: x[0]):
+        conta = extrair_conta(nome, dados)
+        if conta is None: sem_conta.append(nome); continue
+        (extratos if nome.lower().endswith('.pdf') else razoes).setdefault(conta, []).append((nome, dados))
+    
+    # Dois extratos (ou dois razões) com a mesma conta: não há como saber qual par é o certo
+    contas_repetidas = {conta for grupo in (extratos, razoes) for conta, lista in grupo.items() if len(lista) > 1}
+    ambiguos = [(conta, nome) for grupo in (extratos, razoes) for conta, lista in grupo.items() if conta in contas_repetidas for nome, _ in lista]
+    extratos = {conta: lista[0] for conta, lista in extratos.items() if conta not in contas_repetidas}
+    razoes = {conta: lista[0] for conta, lista in razoes.items() if conta not in contas_repetidas}
+    
+    # 1º conta idêntica
+    pares = []
+    for conta in [c for c in extratos if c in razoes]:
+        (nome_pdf, pdf_bytes), (nome_raz, raz_bytes) = extratos.pop(conta), razoes.pop(conta)
+        pares.append((conta, nome_pdf, pdf_bytes, nome_raz, raz_bytes))
+    
+    # 2º conta equivalente, só quando a correspondência é única nos dois sentidos
+    candidatos = {conta: [c for c in razoes if contas_equivalentes(conta, c)] for conta in extratos}
+    disputados = set()
+    for conta, contas_raz in candidatos.items():
+        if len(contas_raz) == 1 and sum(contas_raz[0] in outras for outras in candidatos.values()) == 1:
+            (nome_pdf, pdf_bytes), (nome_raz, raz_bytes) = extratos.pop(conta), razoes.pop(contas_raz[0])
+            pares.append((conta, nome_pdf, pdf_bytes, nome_raz, raz_bytes))
+        elif contas_raz:
+            disputados.add(conta); disputados.update(contas_raz)
+    for grupo in (extratos, razoes):
+        for conta in [c for c in grupo if c in disputados]:
+            ambiguos.append((conta, grupo.pop(conta)[0]))
+    
+    extratos_livres = [(conta, nome, dados) for conta, (nome, dados) in extratos.items()]
+    razoes_livres = [(conta, nome, dados) for conta, (nome, dados) in razoes.items()]
+    return pares, extratos_livres, razoes_livres, sorted(ambiguos, key=lambda x: x[1]), sem_conta
+
+def conciliar_conta(args):
+    # Worker: uma conta completa (extrato x razão), com erro isolado por conta
+    conta, nome_pdf, pdf_bytes, nome_raz, raz_bytes, motor = args
+    nome_base = os.path.splitext(nome_pdf)[0]
+    item = {'Conta': conta, 'Extrato': nome_pdf, 'Razão': nome_raz, 'nome_base': nome_base}
+    try:
+        _, df_p, df_e, df_f, coords_ref = conciliar_com_cache(pdf_bytes, raz_bytes, nome_raz.lower().endswith('csv'), motor, paralelo=False)
+        if df_p.empty or df_e.empty:
+            item['Status'] = "Erro no processamento"
+            return item
+        df_mestre = df_f[df_f['Tipo'] == 'Mestre']
+        item.update({
+            'Status': "OK",
+            'Total Extrato': df_mestre['Valor_Extrato'].sum(),
+            'Total Razão': df_mestre['Valor_Razao'].sum(),
+            'Diferença': df_mestre['Diferença'].sum(),
+            'Divergências': int((df_mestre['Diferença'].abs() >= 0.01).sum()),
+            'df_f': df_f,
+            'pdf_final': gerar_pdf_final(df_f, f"Conciliação {nome_base}"),
+            'pdf_marcado': gerar_extrato_marcado(pdf_bytes, df_f, coords_ref, nome_base),
+        })
+    except Exception as e:
+        item['Status'] = f"Erro: {e}"
+    return item
+
+def processar_lote(arquivos, motor="pdfplumber", n_processos=N_PROCESSOS):
+    pares, extratos_livres, razoes_livres, ambiguos, sem_conta = parear_arquivos_lote(arquivos)
+    tarefas = [(conta, nome_pdf, pdf_bytes, nome_raz, raz_bytes, motor) for conta, nome_pdf, pdf_bytes, nome_raz, raz_bytes in pares]
+    if n_processos > 1 and len(tarefas) > 1:
+        with executor_processos(min(n_processos, len(tarefas))) as executor:
+            resultados = list(executor.map(conciliar_conta, tarefas))
+    else:
+        resultados = [conciliar_conta(t) for t in tarefas]
+    
+    resultados += [{'Conta': c, 'Extrato': n, 'Razão': '', 'Status': "Sem razão"} for c, n, _ in extratos_livres]
+    resultados += [{'Conta': c, 'Extrato': '', 'Razão': n, 'Status': "Sem extrato"} for c, n, _ in razoes_livres]
+    resultados += [{'Conta': c, 'Extrato': n if n.lower().endswith('.pdf') else '', 'Razão': '' if n.lower().endswith('.pdf') else n, 'Status': "Conta ambígua"} for c, n in ambiguos]
+    resultados += [{'Conta': '', 'Extrato': n if n.lower().endswith('.pdf') else '', 'Razão': '' if n.lower().endswith('.pdf') else n, 'Status': "Conta não identificada"} for n in sem_conta]
+    return resultados
+
+def resumo_lote(resultados):
+    colunas = ['Conta', 'Extrato', 'Razão', 'Status', 'Total Extrato', 'Total Razão', 'Diferença', 'Divergências']
+    return pd.DataFrame([{c: r.get(c) for c in colunas} for r in resultados], columns=colunas)
+
+def gerar_excel_lote(resultados):
+    output = io.BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    fmt = criar_formatos_excel(workbook)
+    
+    df_resumo = resumo_lote(resultados)
+    ws = workbook.add_worksheet('Resumo')
+    ws.set_column('A:A', 15)
+    ws.set_column('B:D', 35)
+    ws.set_column('E:G', 18, fmt['currency'])
+    ws.set_column('H:H', 12)
+    ws.write_row(0, 0, list(df_resumo.columns), fmt['header'])
+    for excel_row, linha in enumerate(df_resumo.astype(object).where(df_resumo.notna(), '').values.tolist(), start=1):
+        ws.write_row(excel_row, 0, linha)
+    
+    nomes_usados = {'Resumo'}
+    for r in resultados:
+        if 'df_f' not in r: continue
+        # Nome da aba: conta (máx. 31 caracteres, sem repetir)
+        nome_aba, n = r['Conta'][:31], 2
+        while nome_aba in nomes_usados:
+            sufixo = f"_{n}"; nome_aba = r['Conta'][:31 - len(sufixo)] + sufixo; n += 1
+        nomes_usados.add(nome_aba)
+        escrever_aba_conciliacao(workbook, fmt, r['df_f'], nome_aba)
+    workbook.close()
+    return output.getvalue()
+
+def gerar_zip_lote(resultados):
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as z:
+        for r in resultados:
+            if 'df_f' not in r: continue
+            z.writestr(f"Conciliacao_{r['nome_base']}.pdf", r['pdf_final'])
+            z.writestr(f"{r['nome_base']}_Marcado.pdf", r['pdf_marcado'])
+    return output.getvalue()
+
+# ==============================================================================
+# 4. INTERFACE
 # ==============================================================================
 st.markdown("<h1 style='text-align: center;'>Conciliador Bancário (Banco x GovBr)</h1>", unsafe_allow_html=True)
 st.markdown("---")
@@ -589,91 +1181,133 @@ with c2:
     st.markdown('<p class="big-label">Selecione o Razão da Contabilidade em Excel</p>', unsafe_allow_html=True)
     up_xlsx = st.file_uploader("", type=["xlsx", "csv"], key="up_xlsx", label_visibility="collapsed")
 
+motor_pdf = st.radio("Motor de leitura do PDF", MOTORES_EXTRACAO, horizontal=True, key="motor_pdf")
+
 if st.button("PROCESSAR CONCILIAÇÃO", use_container_width=True):
     if up_pdf and up_xlsx:
         with st.spinner("Processando..."):
             pdf_bytes = up_pdf.read()
             xlsx_bytes = up_xlsx.read()
             
-            df_p, coords_ref = processar_pdf(pdf_bytes)
-            df_e = processar_excel_detalhado(xlsx_bytes, df_p, is_csv=up_xlsx.name.endswith('csv'))
+            chave, df_p, df_e, df_f, coords_ref = conciliar_com_cache(pdf_bytes, xlsx_bytes, up_xlsx.name.endswith('csv'), motor_pdf)
             
             if df_p.empty or df_e.empty: st.error("Erro no processamento."); st.stop()
             
-            df_f = executar_conciliacao_inteligente(df_p, df_e)
-            
-            # --- TABELA HTML (VISUAL) ---
-            html = "<div style='background-color: white; padding: 15px; border-radius: 5px; border: 1px solid #ddd;'>"
-            html += "<table style='width:100%; border-collapse: collapse; color: black !important; background-color: white !important; font-family: Arial, sans-serif;'>"
-            html += "<tr style='background-color: black; color: white !important;'>"
-            html += "<th style='padding: 8px; border: 1px solid #000;'>Data</th>"
-            html += "<th style='padding: 8px; border: 1px solid #000;'>Lançamento</th>"
-            html += "<th style='padding: 8px; border: 1px solid #000;'>Histórico</th>"
-            html += "<th style='padding: 8px; border: 1px solid #000;'>Documento</th>"
-            html += "<th style='padding: 8px; border: 1px solid #000;'>Vlr. Extrato</th>"
-            html += "<th style='padding: 8px; border: 1px solid #000;'>Vlr. Razão</th>"
-            html += "<th style='padding: 8px; border: 1px solid #000;'>Diferença</th></tr>"
-            
-            for _, r in df_f.iterrows():
-                if r['Tipo'] == 'Detalhe':
-                    style_row = "background-color: #f2f2f2; color: #000; font-size: 11px; line-height: 1.0;"
-                    style_cell = "padding: 2px 8px; border: 1px solid #000;"
-                    html += f"<tr style='{style_row}'>"
-                    html += f"<td style='{style_cell} text-align: center;'></td>" 
-                    html += f"<td style='{style_cell} text-align: center;'>{r['Lancamento']}</td>"
-                    html += f"<td style='{style_cell} font-size: 11px;'></td>" 
-                    html += f"<td style='{style_cell}'></td>" 
-                    html += f"<td style='{style_cell} text-align: right;'>{formatar_moeda_br(r['Valor_Extrato'])}</td>"
-                    html += f"<td style='{style_cell} text-align: right;'>{formatar_moeda_br(r['Valor_Razao'])}</td>"
-                    html += f"<td style='{style_cell}'></td></tr>"
-                else:
-                    estilo_dif = "color: red; font-weight: bold;" if abs(r['Diferença']) >= 0.01 else "color: black;"
-                    html += f"<tr style='background-color: white;'>"
-                    html += f"<td style='text-align: center; border: 1px solid #000; color: black;'>{r['Data']}</td>"
-                    html += f"<td style='text-align: center; border: 1px solid #000; color: black;'>{r['Lancamento']}</td>"
-                    html += f"<td style='text-align: left; border: 1px solid #000; color: black; font-size: 11px;'>{r['Histórico']}</td>"
-                    html += f"<td style='text-align: center; border: 1px solid #000; color: black;'>{r['Documento']}</td>"
-                    html += f"<td style='text-align: right; border: 1px solid #000; color: black;'>{formatar_moeda_br(r['Valor_Extrato'])}</td>"
-                    html += f"<td style='text-align: right; border: 1px solid #000; color: black;'>{formatar_moeda_br(r['Valor_Razao'])}</td>"
-                    html += f"<td style='text-align: right; border: 1px solid #000; {estilo_dif}'>{formatar_moeda_br(r['Diferença']) if abs(r['Diferença']) >= 0.01 else '-'}</td></tr>"
-            
-            df_mestre = df_f[df_f['Tipo'] == 'Mestre']
-            html += f"<tr style='font-weight: bold; background-color: lightgrey; color: black;'><td colspan='4' style='padding: 10px; text-align: center; border: 1px solid #000;'>TOTAL</td>"
-            html += f"<td style='text-align: right; border: 1px solid #000;'>{formatar_moeda_br(df_mestre['Valor_Extrato'].sum())}</td>"
-            html += f"<td style='text-align: right; border: 1px solid #000;'>{formatar_moeda_br(df_mestre['Valor_Razao'].sum())}</td>"
-            html += f"<td style='text-align: right; border: 1px solid #000;'>{formatar_moeda_br(df_mestre['Diferença'].sum())}</td></tr></table></div>"
-            st.markdown(html, unsafe_allow_html=True)
-            
             nome_base = os.path.splitext(up_pdf.name)[0]
             
-            pdf_bytes_final = gerar_pdf_final(df_f, f"Conciliação {nome_base}")
-            excel_bytes_final = gerar_excel_final(df_f)
-            pdf_marcado_final = gerar_extrato_marcado(pdf_bytes, df_f, coords_ref, nome_base)
-            
-            st.markdown("<div style='height: 30px;'></div>", unsafe_allow_html=True)
-            
-            st.download_button(
-                label="BAIXAR RELATÓRIO DE CONCILIAÇÃO EM PDF",
-                data=pdf_bytes_final,
-                file_name=f"Conciliacao_{nome_base}.pdf",
-                mime="application/pdf",
-                use_container_width=True
-            )
-            
-            st.download_button(
-                label="GERAR RELATÓRIO EM EXCEL",
-                data=excel_bytes_final,
-                file_name=f"Conciliacao_{nome_base}.xlsx", 
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                use_container_width=True
-            )
-            
+            # Resultado fica na sessão: filtros e paginação apenas re-renderizam a partir dele
+            st.session_state['conciliacao'] = {
+                'chave': chave,
+                'df_f': df_f,
+                'nome_base': nome_base,
+                'pdf_bytes': pdf_bytes,
+                'coords_ref': coords_ref,
+            }
+            # Filtros do resultado anterior (ex.: período de outro mês) não valem para o novo
+            for chave_filtro in FILTROS_RESULTADO: st.session_state.pop(chave_filtro, None)
+    else:
+        st.warning("⚠️ Selecione os dois arquivos primeiro.")
+
+if 'conciliacao' in st.session_state:
+    resultado = st.session_state['conciliacao']
+    df_f = resultado['df_f']
+    nome_base = resultado['nome_base']
+    
+    # --- FILTROS (SERVIDOR) ---
+    datas_mestre = pd.to_datetime(df_f.loc[df_f['Tipo'] == 'Mestre', 'Data'], format='%d/%m/%Y', errors='coerce').dropna()
+    f1, f2, f3 = st.columns([1, 1, 1])
+    with f1:
+        somente_div = st.checkbox("Somente divergências", key="filtro_div")
+    with f2:
+        periodo = st.date_input("Período", value=(datas_mestre.min(), datas_mestre.max()), format="DD/MM/YYYY", key="filtro_periodo") if not datas_mestre.empty else None
+    with f3:
+        filtro_doc = st.text_input("Documento", key="filtro_doc")
+    
+    if periodo is not None and len(periodo) != 2: periodo = None
+    df_view = filtrar_resultado(df_f, somente_div, periodo, filtro_doc.strip())
+    
+    # --- TABELA PAGINADA ---
+    n_mestres = int((df_view['Tipo'] == 'Mestre').sum())
+    n_paginas = max(1, -(-n_mestres // LINHAS_POR_PAGINA))
+    p1, p2 = st.columns([1, 3])
+    with p1:
+        pagina = st.number_input("Página", min_value=1, max_value=n_paginas, value=1, step=1)
+    inicio = (pagina - 1) * LINHAS_POR_PAGINA
+    with p2:
+        st.markdown(f"<div style='padding-top: 35px;'>Exibindo {min(inicio + 1, n_mestres)}–{min(inicio + LINHAS_POR_PAGINA, n_mestres)} de {n_mestres} lançamentos (página {pagina}/{n_paginas})</div>", unsafe_allow_html=True)
+    
+    st.markdown(gerar_tabela_html(paginar_resultado(df_view, pagina), df_view), unsafe_allow_html=True)
+    
+    st.markdown("<div style='height: 30px;'></div>", unsafe_allow_html=True)
+    
+    # Cada saída só é gerada quando pedida (GERAR); os bytes ficam no resultado da sessão para o download
+    artefatos = resultado.setdefault('artefatos', {})
+    for tipo, rotulo, nome_arquivo, mime in [
+        ('pdf', "RELATÓRIO DE CONCILIAÇÃO EM PDF", f"Conciliacao_{nome_base}.pdf", "application/pdf"),
+        ('excel', "RELATÓRIO EM EXCEL", f"Conciliacao_{nome_base}.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+        ('marcado', "EXTRATO BANCÁRIO COM MARCAÇÕES", f"{nome_base}_Marcado.pdf", "application/pdf"),
+    ]:
+        if tipo not in artefatos:
+            # Gerado no callback (antes do rerun), para o botão de download já aparecer no lugar deste
+            st.button(f"GERAR {rotulo}", key=f"gerar_{tipo}", use_container_width=True,
+                      on_click=lambda tipo=tipo: artefatos.update({tipo: gerar_artefato(resultado['chave'], tipo, nome_base, resultado)}))
+        else:
             st.download_button(
-                label="BAIXAR EXTRATO BANCÁRIO COM MARCAÇÕES",
-                data=pdf_marcado_final,
-                file_name=f"{nome_base}_Marcado.pdf",
-                mime="application/pdf",
+                label=f"BAIXAR {rotulo}",
+                data=artefatos[tipo],
+                on_click="ignore",
+                file_name=nome_arquivo,
+                mime=mime,
                 use_container_width=True
             )
-    else:
-        st.warning("⚠️ Selecione os dois arquivos primeiro.")
+
+# --- CONCILIAÇÃO EM LOTE ---
+with st.expander("Conciliação em lote (várias contas)"):
+    st.markdown("Envie um ou mais arquivos .zip/.rar (ou os próprios PDFs e Excel) com os extratos e os razões. As contas são pareadas pelos números no nome do arquivo ou, na falta deles, pelo conteúdo.")
+    up_lote = st.file_uploader("Arquivos do lote", type=["zip", "rar", "pdf", "xlsx", "csv"], accept_multiple_files=True, key="up_lote")
+    if st.button("PROCESSAR LOTE", use_container_width=True):
+        if up_lote:
+            with st.spinner("Processando lote..."):
+                arquivos = [m for arq in up_lote for m in ler_arquivos_lote(arq.name, arq.read())]
+                resultados = processar_lote(arquivos, motor=motor_pdf)
+                st.session_state['lote'] = {
+                    'resumo': resumo_lote(resultados),
+                    'excel': gerar_excel_lote(resultados),
+                    'zip': gerar_zip_lote(resultados),
+                }
+        else:
+            st.warning("⚠️ Selecione os arquivos do lote primeiro.")
+
+    if 'lote' in st.session_state:
+        lote = st.session_state['lote']
+        df_resumo = lote['resumo']
+        st.markdown(f"**{int((df_resumo['Status'] == 'OK').sum())} de {len(df_resumo)} contas conciliadas.**")
+        st.dataframe(df_resumo, use_container_width=True)
+        st.download_button(
+            label="BAIXAR PLANILHA CONSOLIDADA DO LOTE",
+            data=lote['excel'],
+            file_name="Conciliacao_Lote.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True
+        )
+        st.download_button(
+            label="BAIXAR RELATÓRIOS EM PDF DO LOTE (.ZIP)",
+            data=lote['zip'],
+            file_name="Conciliacao_Lote.zip",
+            mime="application/zip",
+            use_container_width=True
+        )
+
+# --- PARIDADE DOS MOTORES DE LEITURA ---
+with st.expander("Comparar motores de leitura do PDF (pdfplumber x PyMuPDF)"):
+    up_corpus = st.file_uploader("Extratos para comparação", type="pdf", accept_multiple_files=True, key="up_corpus")
+    if st.button("COMPARAR MOTORES", use_container_width=True) and up_corpus:
+        with st.spinner("Comparando..."):
+            resumos = []
+            for arq in up_corpus:
+                resumo, df_div = comparar_motores_extracao(arq.read())
+                resumos.append({"Arquivo": arq.name, **resumo})
+                if not df_div.empty:
+                    st.markdown(f"**{arq.name}**")
+                    st.dataframe(df_div, use_container_width=True)
+            st.dataframe(pd.DataFrame(resumos), use_container_width=True)
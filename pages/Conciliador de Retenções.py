@@ -4,6 +4,8 @@ import io
 import os
 import re
 import unicodedata
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from PIL import Image
 
@@ -157,6 +159,9 @@ LISTA_CONTAS = [
     "9210 - Emp. Consignado HBI - Scd"
 ]
 
+# Contas da conciliação geral processadas em processos separados (com fork), um por CPU
+N_PROCESSOS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+
 MAPA_MESES = {
     1: "JANEIRO", 2: "FEVEREIRO", 3: "MARCO", 4: "ABRIL",
     5: "MAIO", 6: "JUNHO", 7: "JULHO", 8: "AGOSTO",
@@ -202,18 +207,16 @@ def normalizar_texto(texto):
     nfkd_form = unicodedata.normalize('NFKD', texto)
     return "".join([c for c in nfkd_form if not unicodedata.combining(c)]).upper()
 
+def meses_citados(hist_pagamento):
+    hist_norm = normalizar_texto(hist_pagamento)
+    return [mes_nome for mes_nome in MAPA_MESES.values() if mes_nome in hist_norm]
+
 def verificar_compatibilidade_mes(hist_pagamento, data_retencao):
     if pd.isna(data_retencao):
         return True 
-    hist_norm = normalizar_texto(hist_pagamento)
-    mes_retencao_num = data_retencao.month
-    mes_retencao_nome = MAPA_MESES[mes_retencao_num]
+    mes_retencao_nome = MAPA_MESES[data_retencao.month]
     
-    meses_encontrados = []
-    for mes_num, mes_nome in MAPA_MESES.items():
-        if mes_nome in hist_norm:
-            meses_encontrados.append(mes_nome)
-            
+    meses_encontrados = meses_citados(hist_pagamento)
     if not meses_encontrados:
         return True 
     if mes_retencao_nome in meses_encontrados:
@@ -411,28 +414,93 @@ def preparar_dados_resumo_superior(df):
     df_final = df_final.sort_values(by=['_sort_order', '_dt_sort'])
     return df_final
 
-def processar_conciliacao(df, ug_sel, conta_sel, saldo_anterior_val):
-    cod_ug = ug_sel.split(' - ')[0].strip()
-    cod_conta = conta_sel.split(' - ')[0].strip()
+def valor_em_centavos(valor):
+    if pd.isna(valor): return None
+    return int(round(float(valor) * 100))
+
+def cancelar_estornos(df_lanc, df_est, c_empenho, c_valor):
+    # Cada estorno cancela o primeiro lançamento ainda ativo do mesmo empenho com o mesmo valor (tolerância < 1 centavo)
+    por_empenho = {}
+    for idx, empenho, valor in zip(df_lanc.index, df_lanc[c_empenho], df_lanc[c_valor]):
+        if pd.notna(empenho): por_empenho.setdefault(empenho, []).append((idx, valor))
+    cancelados = set()
+    for empenho, v in zip(df_est[c_empenho], df_est[c_valor]):
+        if pd.isna(empenho): continue
+        for idx, valor in por_empenho.get(empenho, []):
+            if idx not in cancelados and abs(valor - v) < 0.01:
+                cancelados.add(idx)
+                break
+    return cancelados
 
+def parear_retencoes_pagamentos(df_ret, df_pag, c_valor, c_hist):
+    """
+    Pareia cada retenção (na ordem do razão) com o primeiro pagamento livre de mesmo valor
+    em centavos, com data igual ou posterior (ou sem data) e histórico compatível com o mês.
+    Retorna {índice da retenção: índice do pagamento}.
+    """
+    # Pagamentos agrupados por centavos; cada grupo segue a ordem (cronológica) do razão
+    grupos = {}
+    for pos, valor in enumerate(df_pag[c_valor]):
+        chave = valor_em_centavos(valor)
+        if chave is not None: grupos.setdefault(chave, []).append(pos)
+    datas_pag = df_pag['Data_Dt'].tolist()
+    meses_pag = [meses_citados(sanitizar_historico(h)) for h in df_pag[c_hist]]
+    inicio = dict.fromkeys(grupos, 0)  # Ponteiro de consumo: antes dele, todos já foram usados
+    usados = set()
+    pares = {}
+
+    for idx_r, valor, dt_ret in zip(df_ret.index, df_ret[c_valor], df_ret['Data_Dt']):
+        chave = valor_em_centavos(valor)
+        grupo = grupos.get(chave)
+        if not grupo: continue
+        mes_ret = None if pd.isna(dt_ret) else MAPA_MESES[dt_ret.month]
+
+        for pos in grupo[inicio[chave]:]:
+            if pos in usados: continue
+            if mes_ret is not None:
+                if pd.notna(datas_pag[pos]) and datas_pag[pos] < dt_ret: continue
+                if meses_pag[pos] and mes_ret not in meses_pag[pos]: continue
+            pares[idx_r] = df_pag.index[pos]
+            usados.add(pos)
+            break
+
+        while inicio[chave] < len(grupo) and grupo[inicio[chave]] in usados: inicio[chave] += 1
+    return pares
+
+def preparar_razao(df):
+    # Detecta as colunas variáveis e preenche (ffill, no próprio df) as colunas agrupadas do razão
     cols_map = identificar_colunas_dinamicas(df)
-    c_ug, c_status, c_data, c_dc, c_conta, c_valor = 0, 2, 4, 5, 6, 8
-    c_empenho, c_tipo, c_hist = cols_map['empenho'], cols_map['tipo'], cols_map['hist']
+    colunas = {
+        'ug': 0, 'status': 2, 'data': 4, 'dc': 5, 'conta': 6, 'valor': 8,
+        'empenho': cols_map['empenho'], 'tipo': cols_map['tipo'], 'hist': cols_map['hist']
+    }
 
-    colunas_para_preencher = [c_ug, c_status, c_data, c_conta, c_empenho, c_tipo]
+    colunas_para_preencher = [colunas['ug'], colunas['status'], colunas['data'], colunas['conta'], colunas['empenho'], colunas['tipo']]
     for col in colunas_para_preencher:
         if col < df.shape[1]:
             df[col] = df[col].ffill()
+    return colunas
 
+def mascara_ug(df, colunas, ug_sel):
+    cod_ug = ug_sel.split(' - ')[0].strip()
     if cod_ug == '9999':
-        mask_ug = pd.Series(True, index=df.index)
-    else:
-        mask_ug = df[c_ug].astype(str).str.split('.').str[0] == str(cod_ug)
-        
-    mask_conta = df[c_conta].astype(str).str.startswith(str(cod_conta))
-    
-    df_base = df[mask_ug & mask_conta].copy()
+        return pd.Series(True, index=df.index)
+    return df[colunas['ug']].astype(str).str.split('.').str[0] == str(cod_ug)
+
+def processar_conciliacao(df, ug_sel, conta_sel, saldo_anterior_val):
+    cod_conta = conta_sel.split(' - ')[0].strip()
+
+    colunas = preparar_razao(df)
+    mask_ug = mascara_ug(df, colunas, ug_sel)
+    mask_conta = df[colunas['conta']].astype(str).str.startswith(str(cod_conta))
     
+    return conciliar_lancamentos(df[mask_ug & mask_conta].copy(), colunas, saldo_anterior_val)
+
+def conciliar_lancamentos(df_base, colunas, saldo_anterior_val):
+    # Concilia os lançamentos de uma conta (já filtrados por UG e conta)
+    c_status, c_data, c_dc, c_valor = colunas['status'], colunas['data'], colunas['dc'], colunas['valor']
+    c_empenho, c_tipo, c_hist = colunas['empenho'], colunas['tipo'], colunas['hist']
+
     resumo = {
         "ret_pendente": 0, "val_ret_pendente": 0.0,
         "pag_sobra": 0,    "val_pag_sobra": 0.0,
@@ -467,101 +535,68 @@ def processar_conciliacao(df, ug_sel, conta_sel, saldo_anterior_val):
     mask_estorno_pag = condicao_credito & condicao_nome_estorno
     df_est_pag = df_base[mask_estorno_pag].copy()
 
-    idx_ret_cancel = set()
-    for _, r_est in df_est_ret.iterrows():
-        v, e = r_est[c_valor], r_est[c_empenho]
-        cand = df_ret[(df_ret[c_empenho] == e) & (abs(df_ret[c_valor] - v) < 0.01) & (~df_ret.index.isin(idx_ret_cancel))]
-        if not cand.empty: idx_ret_cancel.add(cand.index[0])
+    idx_ret_cancel = cancelar_estornos(df_ret, df_est_ret, c_empenho, c_valor)
     df_ret_limpa = df_ret[~df_ret.index.isin(idx_ret_cancel)]
 
-    idx_pag_cancel = set()
-    for _, r_est in df_est_pag.iterrows():
-        v, e = r_est[c_valor], r_est[c_empenho]
-        cand = df_pag[(df_pag[c_empenho] == e) & (abs(df_pag[c_valor] - v) < 0.01) & (~df_pag.index.isin(idx_pag_cancel))]
-        if not cand.empty: idx_pag_cancel.add(cand.index[0])
+    idx_pag_cancel = cancelar_estornos(df_pag, df_est_pag, c_empenho, c_valor)
     
     df_pag_limpa = df_pag[~df_pag.index.isin(idx_pag_cancel)]
 
     resultados = []
-    idx_pag_usado = set()
+    pares = parear_retencoes_pagamentos(df_ret_limpa, df_pag_limpa, c_valor, c_hist)
+    idx_pag_usado = set(pares.values())
+    # Colunas lidas uma vez (zip) em vez de montar uma Series por linha com iterrows
+    pagamentos = dict(zip(df_pag_limpa.index, zip(df_pag_limpa[c_valor], df_pag_limpa[c_data], df_pag_limpa[c_hist])))
     
-    for _, r in df_ret_limpa.iterrows():
-        val = r[c_valor]
-        dt_retencao = r['Data_Dt']
-        
-        condicao_valor = (df_pag_limpa[c_valor] == val)
-        condicao_usado = (~df_pag_limpa.index.isin(idx_pag_usado))
-        
-        if pd.notna(dt_retencao):
-            condicao_data = (df_pag_limpa['Data_Dt'] >= dt_retencao) | (df_pag_limpa['Data_Dt'].isna())
-            cand = df_pag_limpa[condicao_valor & condicao_data & condicao_usado]
-        else:
-            cand = df_pag_limpa[condicao_valor & condicao_usado]
-        
+    linhas_ret = zip(df_ret_limpa.index, df_ret_limpa[c_valor], df_ret_limpa[c_hist], df_ret_limpa[c_empenho], df_ret_limpa[c_data], df_ret_limpa['Data_Dt'])
+    for idx_r, val, hist_ret, empenho, data_ret, dt_ret in linhas_ret:
         val_pago, dt_pag_str, match, sort = 0.0, "-", False, 0
-        dt_pag_sort = pd.NaT 
-        hist_final = sanitizar_historico(r[c_hist])
+        hist_final = sanitizar_historico(hist_ret)
         
-        r_pag = None
-        match_encontrado = False
-        
-        if not cand.empty:
-            for idx_c, row_c in cand.iterrows():
-                hist_candidato = sanitizar_historico(row_c[c_hist])
-                if verificar_compatibilidade_mes(hist_candidato, dt_retencao):
-                    r_pag = row_c
-                    match_encontrado = True
-                    break
+        if idx_r in pares:
+            val_pago, dt_real_pag, hist_pag = pagamentos[pares[idx_r]]
+            if pd.notna(dt_real_pag):
+                dt_pag_str = formatar_data(dt_real_pag)
             
-            if match_encontrado:
-                val_pago = r_pag[c_valor]
-                dt_real_pag = r_pag[c_data]
-                dt_pag_sort = r['Data_Dt']
-                if pd.notna(dt_real_pag):
-                    dt_pag_str = formatar_data(dt_real_pag)
-                
-                hist_pag = sanitizar_historico(r_pag[c_hist])
-                if hist_pag: 
-                    hist_final = hist_pag
-                
-                idx_pag_usado.add(r_pag.name)
-                match, sort = True, 2
-                resumo["ok"] += 1
-                resumo["val_ok"] += val_pago
-            else:
-                resumo["ret_pendente"] += 1
-                resumo["val_ret_pendente"] += val
+            hist_pag = sanitizar_historico(hist_pag)
+            if hist_pag: 
+                hist_final = hist_pag
+            
+            match, sort = True, 2
+            resumo["ok"] += 1
+            resumo["val_ok"] += val_pago
         else:
             resumo["ret_pendente"] += 1
             resumo["val_ret_pendente"] += val
             
         resultados.append({
-            "Empenho": r[c_empenho], 
-            "Data Emp": formatar_data(r[c_data]), 
+            "Empenho": empenho, 
+            "Data Emp": formatar_data(data_ret), 
             "Vlr Retido": val, 
             "Vlr Pago": val_pago,
             "Dif": val - val_pago, 
             "Data Pag": dt_pag_str, 
             "Histórico": hist_final, 
             "_sort": sort,
-            "_dt_sort": r['Data_Dt'], 
+            "_dt_sort": dt_ret, 
             "Status": "Conciliado" if match else "Retido s/ Pagto"
         })
 
-    for _, r in df_pag_limpa[~df_pag_limpa.index.isin(idx_pag_usado)].iterrows():
+    df_sobra = df_pag_limpa[~df_pag_limpa.index.isin(idx_pag_usado)]
+    for val_pag, empenho, data_pag, hist_pag, dt_pag in zip(df_sobra[c_valor], df_sobra[c_empenho], df_sobra[c_data], df_sobra[c_hist], df_sobra['Data_Dt']):
         resumo["pag_sobra"] += 1
-        resumo["val_pag_sobra"] += r[c_valor]
+        resumo["val_pag_sobra"] += val_pag
         
         resultados.append({
-            "Empenho": r[c_empenho], 
+            "Empenho": empenho, 
             "Data Emp": "-", 
             "Vlr Retido": 0.0, 
-            "Vlr Pago": r[c_valor],
-            "Dif": 0.0 - r[c_valor], 
-            "Data Pag": formatar_data(r[c_data]), 
-            "Histórico": sanitizar_historico(r[c_hist]), 
+            "Vlr Pago": val_pag,
+            "Dif": 0.0 - val_pag, 
+            "Data Pag": formatar_data(data_pag), 
+            "Histórico": sanitizar_historico(hist_pag), 
             "_sort": 1, 
-            "_dt_sort": r['Data_Dt'], 
+            "_dt_sort": dt_pag, 
             "Status": "Pago s/ Retenção"
         })
 
@@ -578,6 +613,110 @@ def processar_conciliacao(df, ug_sel, conta_sel, saldo_anterior_val):
     
     return df_res, resumo
 
+def particionar_por_conta(df, colunas, contas_sel):
+    # Um groupby pelo prefixo da coluna de conta (por tamanho de código) separa os lançamentos de todas as contas
+    contas_txt = df[colunas['conta']].astype(str)
+    codigos = [conta.split(' - ')[0].strip() for conta in contas_sel]
+    particoes = {}
+    for tamanho in sorted({len(cod) for cod in codigos}):
+        grupos = dict(tuple(df.groupby(contas_txt.str[:tamanho], sort=False)))
+        for cod in codigos:
+            if len(cod) == tamanho and cod in grupos: particoes[cod] = grupos[cod]
+    return particoes
+
+# Tarefas em execução paralela, por token: gravadas antes de criar o pool e herdadas pelos workers via fork,
+# para que cada tarefa leve só (token, índice) em vez de uma cópia das partições do razão
+TAREFAS_EM_EXECUCAO = {}
+
+def executar_tarefa(args):
+    token, idx = args
+    funcao, tarefas = TAREFAS_EM_EXECUCAO[token]
+    return funcao(*tarefas[idx])
+
+def executor_processos(max_workers):
+    # fork pelo mesmo motivo do executor_processos do Conciliador Bancário; os workers só conciliam DataFrames
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork"))
+
+def executar_particoes(funcao, tarefas, n_processos=N_PROCESSOS):
+    # funcao(*tarefa) para cada tarefa, na ordem
+    n_processos = max(1, min(n_processos, len(tarefas)))
+    if n_processos == 1 or "fork" not in multiprocessing.get_all_start_methods():
+        return [funcao(*tarefa) for tarefa in tarefas]
+
+    token = os.urandom(8).hex()  # Sessões simultâneas não se misturam
+    TAREFAS_EM_EXECUCAO[token] = (funcao, tarefas)
+    try:
+        with executor_processos(n_processos) as executor:
+            # Lotes de tarefas por envio: a matriz tem centenas de células pequenas
+            lote = max(1, len(tarefas) // (n_processos * 4))
+            return list(executor.map(executar_tarefa, [(token, idx) for idx in range(len(tarefas))], chunksize=lote))
+    finally:
+        TAREFAS_EM_EXECUCAO.pop(token, None)
+
+def resumir_conta(df_base, colunas, saldo_anterior_val):
+    return conciliar_lancamentos(df_base.copy(), colunas, saldo_anterior_val)[1]
+
+def processar_conciliacao_geral(df, ug_sel, contas_saldos, n_processos=N_PROCESSOS):
+    """
+    Conciliação de várias contas da mesma UG com uma única preparação do razão.
+    contas_saldos: lista de (conta, saldo anterior). Retorna a tabela do relatório geral.
+    """
+    colunas = preparar_razao(df)
+    df_ug = df[mascara_ug(df, colunas, ug_sel)]
+    particoes = particionar_por_conta(df_ug, colunas, [conta for conta, _ in contas_saldos])
+    vazio = df_ug.iloc[0:0]
+
+    tarefas = [(particoes.get(conta.split(' - ')[0].strip(), vazio), colunas, saldo_ant) for conta, saldo_ant in contas_saldos]
+    resumos = executar_particoes(resumir_conta, tarefas, n_processos)
+
+    return pd.DataFrame([{
+        "Conta De Retenção": conta,
+        "Saldo Anterior": saldo_ant,
+        "Retido Período": resumo['tot_ret'],
+        "Pago Período": resumo['tot_pag'],
+        "Saldo A Pagar": resumo['saldo']
+    } for (conta, saldo_ant), resumo in zip(contas_saldos, resumos)])
+
+def processar_matriz_ugs(df, contas_sel, n_processos=N_PROCESSOS):
+    """
+    Matriz UG × conta de retenção de todas as UGs com uma única preparação do razão.
+    Cada célula é a conciliação da conta na UG (sem saldo anterior), calculada por partição.
+    Retorna uma linha por célula: UG, Conta De Retenção, Retido Período, Pago Período, Saldo A Pagar.
+    """
+    colunas_saida = ["UG", "Conta De Retenção", "Retido Período", "Pago Período", "Saldo A Pagar"]
+    colunas = preparar_razao(df)
+    cod_ug_linha = df[colunas['ug']].astype(str).str.split('.').str[0]
+    grupos_ug = dict(tuple(df.groupby(cod_ug_linha, sort=False)))
+
+    celulas, tarefas = [], []
+    for ug in LISTA_UGS:
+        cod_ug = ug.split(' - ')[0].strip()
+        if cod_ug == '9999' or cod_ug not in grupos_ug: continue
+        df_ug = grupos_ug[cod_ug]
+        particoes = particionar_por_conta(df_ug, colunas, contas_sel)
+        vazio = df_ug.iloc[0:0]
+        for conta in contas_sel:
+            celulas.append((ug, conta))
+            tarefas.append((particoes.get(conta.split(' - ')[0].strip(), vazio), colunas, 0.0))
+
+    resumos = executar_particoes(resumir_conta, tarefas, n_processos)
+    return pd.DataFrame([{
+        "UG": ug,
+        "Conta De Retenção": conta,
+        "Retido Período": resumo['tot_ret'],
+        "Pago Período": resumo['tot_pag'],
+        "Saldo A Pagar": resumo['saldo']
+    } for (ug, conta), resumo in zip(celulas, resumos)], columns=colunas_saida)
+
+def montar_pivot_matriz(df_matriz, medida):
+    # Contas nas linhas, UGs nas colunas (na ordem da matriz), com coluna e linha TOTAL
+    contas = list(dict.fromkeys(df_matriz["Conta De Retenção"]))
+    ugs = list(dict.fromkeys(df_matriz["UG"]))
+    pivot = df_matriz.pivot(index="Conta De Retenção", columns="UG", values=medida).reindex(index=contas, columns=ugs).fillna(0.0)
+    pivot["TOTAL"] = pivot.sum(axis=1)
+    pivot.loc["TOTAL"] = pivot.sum(axis=0)
+    return pivot
+
 def gerar_excel(df, resumo, saldo_anterior, ug, conta):
     out = io.BytesIO()
     # Remove colunas auxiliares
@@ -758,12 +897,56 @@ def gerar_pdf(df_f, ug, conta, resumo, saldo_anterior):
     doc.build(story)
     return buffer.getvalue()
 
+def escrever_planilha_geral(writer, nome_aba, df_resumo, ug):
+    df_resumo.to_excel(writer, sheet_name=nome_aba, index=False, startrow=2)
+    wb = writer.book
+    ws = writer.sheets[nome_aba]
+    col_saldo = list(df_resumo.columns).index('Saldo A Pagar')
+    
+    fmt_title = wb.add_format({'bold': True, 'bg_color': '#E6E6E6', 'border': 1, 'align': 'center', 'valign': 'vcenter', 'font_size': 14})
+    fmt_head = wb.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1, 'align': 'center', 'valign': 'vcenter'})
+    fmt_money = wb.add_format({'num_format': '#,##0.00', 'border': 1, 'align': 'right', 'valign': 'vcenter'})
+    fmt_text = wb.add_format({'border': 1, 'align': 'left', 'valign': 'vcenter'})
+    fmt_green = wb.add_format({'font_color': '#006400', 'bold': True, 'num_format': '#,##0.00', 'border': 1, 'align': 'right', 'valign': 'vcenter'})
+    fmt_red = wb.add_format({'font_color': '#FF0000', 'bold': True, 'num_format': '#,##0.00', 'border': 1, 'align': 'right', 'valign': 'vcenter'})
+    
+    ws.merge_range(0, 0, 0, len(df_resumo.columns) - 1, f"Relatório Geral de Retenções | UG: {ug}", fmt_title)
+    
+    for i, col in enumerate(df_resumo.columns):
+        ws.write(2, i, col, fmt_head)
+        
+    for row_num, row_data in enumerate(df_resumo.values):
+        excel_row = row_num + 3
+        for col_num, cell_data in enumerate(row_data):
+            if col_num == 0:
+                ws.write(excel_row, col_num, cell_data, fmt_text)
+            else:
+                style = fmt_money
+                if col_num == col_saldo:
+                    if cell_data > 0.01: style = fmt_red
+                    elif cell_data < -0.01: style = fmt_green
+                ws.write(excel_row, col_num, cell_data, style)
+
+    for i, col in enumerate(df_resumo.columns):
+        max_len = len(str(col))
+        for val in df_resumo[col]:
+            val_len = len(str(val))
+            if val_len > max_len: max_len = val_len
+        ws.set_column(i, i, max_len + 2)
+
 def gerar_excel_geral(df_resumo, ug):
     out = io.BytesIO()
     with pd.ExcelWriter(out, engine='xlsxwriter') as writer:
-        df_resumo.to_excel(writer, sheet_name='Geral', index=False, startrow=2)
+        escrever_planilha_geral(writer, 'Geral', df_resumo, ug)
+    return out.getvalue()
+
+def gerar_excel_matriz(df_matriz):
+    # Aba "Consolidado" com a matriz conta × UG de cada valor, seguida de uma aba por UG no formato do relatório geral
+    out = io.BytesIO()
+    with pd.ExcelWriter(out, engine='xlsxwriter') as writer:
         wb = writer.book
-        ws = writer.sheets['Geral']
+        ws = wb.add_worksheet('Consolidado')
+        writer.sheets['Consolidado'] = ws
         
         fmt_title = wb.add_format({'bold': True, 'bg_color': '#E6E6E6', 'border': 1, 'align': 'center', 'valign': 'vcenter', 'font_size': 14})
         fmt_head = wb.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1, 'align': 'center', 'valign': 'vcenter'})
@@ -771,30 +954,39 @@ def gerar_excel_geral(df_resumo, ug):
         fmt_text = wb.add_format({'border': 1, 'align': 'left', 'valign': 'vcenter'})
         fmt_green = wb.add_format({'font_color': '#006400', 'bold': True, 'num_format': '#,##0.00', 'border': 1, 'align': 'right', 'valign': 'vcenter'})
         fmt_red = wb.add_format({'font_color': '#FF0000', 'bold': True, 'num_format': '#,##0.00', 'border': 1, 'align': 'right', 'valign': 'vcenter'})
+        fmt_tot_label = wb.add_format({'bold': True, 'bg_color': '#E6E6E6', 'border': 1, 'align': 'left', 'valign': 'vcenter'})
+        fmt_tot_val = wb.add_format({'bold': True, 'bg_color': '#E6E6E6', 'num_format': '#,##0.00', 'border': 1, 'align': 'right', 'valign': 'vcenter'})
         
-        ws.merge_range('A1:E1', f"Relatório Geral de Retenções | UG: {ug}", fmt_title)
+        n_ugs = df_matriz['UG'].nunique()
+        ws.merge_range(0, 0, 0, n_ugs + 1, "Matriz de Retenções por UG e Conta", fmt_title)
         
-        for i, col in enumerate(df_resumo.columns):
-            ws.write(2, i, col, fmt_head)
+        linha = 2
+        for medida in ["Retido Período", "Pago Período", "Saldo A Pagar"]:
+            pivot = montar_pivot_matriz(df_matriz, medida)
+            ws.merge_range(linha, 0, linha, len(pivot.columns), medida.upper(), fmt_head)
+            linha += 1
+            ws.write(linha, 0, "Conta De Retenção", fmt_head)
+            for col_num, col in enumerate(pivot.columns, start=1):
+                ws.write(linha, col_num, col, fmt_head)
+            linha += 1
             
-        for row_num, row_data in enumerate(df_resumo.values):
-            excel_row = row_num + 3
-            for col_num, cell_data in enumerate(row_data):
-                if col_num == 0:
-                    ws.write(excel_row, col_num, cell_data, fmt_text)
-                else:
-                    style = fmt_money
-                    if col_num == 4:
-                        if cell_data > 0.01: style = fmt_red
-                        elif cell_data < -0.01: style = fmt_green
-                    ws.write(excel_row, col_num, cell_data, style)
-
-        for i, col in enumerate(df_resumo.columns):
-            max_len = len(str(col))
-            for val in df_resumo[col]:
-                val_len = len(str(val))
-                if val_len > max_len: max_len = val_len
-            ws.set_column(i, i, max_len + 2)
+            for conta, valores in pivot.iterrows():
+                eh_total = conta == "TOTAL"
+                ws.write(linha, 0, conta, fmt_tot_label if eh_total else fmt_text)
+                for col_num, valor in enumerate(valores, start=1):
+                    style = fmt_tot_val if (eh_total or col_num == len(pivot.columns)) else fmt_money
+                    if medida == "Saldo A Pagar" and not eh_total:
+                        if valor > 0.01: style = fmt_red
+                        elif valor < -0.01: style = fmt_green
+                    ws.write(linha, col_num, valor, style)
+                linha += 1
+            linha += 1
+        
+        ws.set_column(0, 0, max(len(str(c)) for c in df_matriz['Conta De Retenção']) + 2)
+        ws.set_column(1, n_ugs + 1, 16)
+        
+        for ug, df_ug in df_matriz.groupby('UG', sort=False):
+            escrever_planilha_geral(writer, limpar_nome_arquivo(ug)[:31], df_ug.drop(columns=['UG']), ug)
     return out.getvalue()
 
 def gerar_pdf_geral(df_resumo, ug):
@@ -873,6 +1065,30 @@ def gerar_tabela_html_geral(df_resultado):
     html += "</table></div>"
     return html
 
+def gerar_tabela_html_matriz(pivot):
+    # Saldo a pagar por conta (linhas) e UG (colunas); contas sem movimento em nenhuma UG são omitidas
+    pivot = pivot[(pivot.abs() > 0.001).any(axis=1) | (pivot.index == "TOTAL")]
+    html = "<div style='background-color: white; padding: 15px; border-radius: 5px; border: 1px solid #ddd; overflow-x: auto;'>"
+    html += "<table style='width:100%; border-collapse: collapse; color: black !important; background-color: white !important;'>"
+    html += "<tr style='background-color: black; color: white !important;'>"
+    html += "<th style='padding: 8px; border: 1px solid #000; text-align: left;'>Conta de Retenção</th>"
+    for col in pivot.columns:
+        html += f"<th style='padding: 8px; border: 1px solid #000; text-align: right;'>{col}</th>"
+    html += "</tr>"
+    
+    for conta, valores in pivot.iterrows():
+        eh_total = conta == "TOTAL"
+        fundo = "#E6E6E6" if eh_total else "white"
+        peso = "bold" if eh_total else "normal"
+        html += f"<tr style='background-color: {fundo}; font-weight: {peso};'>"
+        html += f"<td style='border: 1px solid #000; text-align: left; color: black;'>{conta}</td>"
+        for valor in valores:
+            style_saldo = "color: red; font-weight: bold;" if valor > 0.01 else ("color: darkgreen; font-weight: bold;" if valor < -0.01 else "color: black;")
+            html += f"<td style='border: 1px solid #000; text-align: right; {style_saldo}'>{formatar_moeda_br(valor)}</td>"
+        html += "</tr>"
+    html += "</table></div>"
+    return html
+
 # ==============================================================================
 # 2. INTERFACE GRÁFICA (AJUSTADA)
 # ==============================================================================
@@ -920,7 +1136,7 @@ if arquivo:
             st.markdown("<br>", unsafe_allow_html=True)
         
         # BOTÕES LADO A LADO FORA DO PLACEHOLDER
-        c_btn_geral, c_btn_indiv = st.columns(2)
+        c_btn_geral, c_btn_indiv, c_btn_matriz = st.columns(3)
         
         with c_btn_geral:
             if st.button("PROCESSAR CONCILIAÇÃO GERAL", use_container_width=True):
@@ -933,6 +1149,12 @@ if arquivo:
                 st.session_state['modo_conciliacao'] = 'individual'
                 st.session_state['executar_individual'] = True
 
+        with c_btn_matriz:
+            if st.button("PROCESSAR MATRIZ UG × CONTA", use_container_width=True):
+                st.session_state['modo_conciliacao'] = 'matriz'
+                st.session_state['executar_individual'] = False
+                st.session_state['executar_matriz'] = True
+
         st.markdown("---")
         
         # MODO INDIVIDUAL
@@ -1134,26 +1356,11 @@ if arquivo:
                 # 1. Primeiro passo: Salvar o que foi digitado no estado geral
                 st.session_state['df_saldos_geral'] = edited_df
                 
-                resultados_gerais = []
-                progresso = st.progress(0)
-                
-                # Usamos o edited_df que veio direto do formulário
-                total_contas = len(edited_df)
-                
-                for idx, row in edited_df.iterrows():
-                    conta = row['CONTA DE RETENÇÃO']
-                    saldo_ant = row['SALDO ANTERIOR']
-                    _, resumo = processar_conciliacao(df_dados, ug_sel, conta, saldo_ant)
-                    resultados_gerais.append({
-                        "Conta De Retenção": conta,
-                        "Saldo Anterior": saldo_ant,
-                        "Retido Período": resumo['tot_ret'],
-                        "Pago Período": resumo['tot_pag'],
-                        "Saldo A Pagar": resumo['saldo']
-                    })
-                    progresso.progress((idx + 1) / total_contas)
+                # Usamos o edited_df que veio direto do formulário; o razão é preparado uma única vez para todas as contas
+                with st.spinner("Processando..."):
+                    contas_saldos = list(zip(edited_df['CONTA DE RETENÇÃO'], edited_df['SALDO ANTERIOR']))
+                    df_resultado_geral = processar_conciliacao_geral(df_dados, ug_sel, contas_saldos)
                 
-                df_resultado_geral = pd.DataFrame(resultados_gerais)
                 st.success("Conciliação Geral concluída!")
                 
                 html_geral = gerar_tabela_html_geral(df_resultado_geral)
@@ -1168,5 +1375,33 @@ if arquivo:
                 
                 pdf_bytes_geral = gerar_pdf_geral(df_resultado_geral, ug_sel)
                 st.download_button("BAIXAR RELATÓRIO GERAL (PDF)", pdf_bytes_geral, f"{nome_base_geral}.pdf", "application/pdf", use_container_width=True)
+
+        # MODO MATRIZ (TODAS AS UGs)
+        elif st.session_state['modo_conciliacao'] == 'matriz':
+            st.markdown("### Matriz de Retenções por UG e Conta")
+            st.info("Todas as UGs e contas de retenção, sem saldo anterior: valores retidos, pagos e saldo a pagar do período.")
+            
+            # Calculada só no clique do botão; reruns (download, troca de filtros) reaproveitam o resultado da sessão
+            if st.session_state.pop('executar_matriz', False):
+                with st.spinner("Processando..."):
+                    df_matriz = processar_matriz_ugs(df_dados, LISTA_CONTAS)
+                    st.session_state['resultado_matriz'] = {
+                        'arquivo': arquivo.file_id,
+                        'df_matriz': df_matriz,
+                        'excel': gerar_excel_matriz(df_matriz) if not df_matriz.empty else None,
+                    }
+            
+            resultado_matriz = st.session_state.get('resultado_matriz')
+            if resultado_matriz is None or resultado_matriz['arquivo'] != arquivo.file_id:
+                st.info("Clique em PROCESSAR MATRIZ UG × CONTA para calcular a matriz deste razão.")
+            elif not resultado_matriz['df_matriz'].empty:
+                df_matriz = resultado_matriz['df_matriz']
+                st.success(f"Matriz concluída: {df_matriz['UG'].nunique()} UGs × {len(LISTA_CONTAS)} contas.")
+                st.markdown(gerar_tabela_html_matriz(montar_pivot_matriz(df_matriz, "Saldo A Pagar")), unsafe_allow_html=True)
+                st.markdown("<br>", unsafe_allow_html=True)
+                
+                st.download_button("BAIXAR MATRIZ UG × CONTA (XLSX)", resultado_matriz['excel'], "Matriz_Retencoes_UG_Conta.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
+            else:
+                st.warning("Nenhuma UG da lista encontrada no razão.")
     else:
         st.warning("Nenhum dado encontrado para os filtros selecionados.")
@@ -8,10 +8,19 @@ import re
 import io
 import os
 import shutil
+import subprocess
+import zlib
+import functools
+import hashlib
+import sqlite3
 import tempfile
 import unicodedata
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import deque
 from PIL import Image
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 # --- IMPORTAÇÕES PARA PDF (REPORTLAB) ---
 from reportlab.lib.pagesizes import A4, landscape
@@ -19,10 +28,24 @@ from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, KeepTogether
 from reportlab.lib.units import mm
+import fitz  # Requer pymupdf no requirements.txt
 
 # Configuração do executável UNRAR
 rarfile.UNRAR_TOOL = "unrar"
 
+# Leitura dos extratos em processos separados (um PDF por vez em cada processo)
+N_PROCESSOS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+TEMPO_LIMITE_PDF = 60  # Segundos por arquivo; acima disso o processo é encerrado e o arquivo marcado como Timeout
+
+# Cache persistente de (saldo, banco) por conteúdo do PDF; entradas sem uso há mais de CACHE_SALDOS_DIAS são descartadas
+CACHE_SALDOS = os.path.join(tempfile.gettempdir(), "conciliador_saldos_cache.sqlite")
+CACHE_SALDOS_DIAS = 90
+VERSAO_REGRAS_SALDO = 3  # Entra na chave do cache: incrementar a cada mudança em REGRAS_SALDO ou encontrar_saldo_pdf
+
+# Páginas finais lidas (além da 1ª) antes da leitura completa; None = banco sempre lido por inteiro
+# (Santander escolhe a linha do mês entre todas as do documento)
+PAGINAS_FINAIS_POR_BANCO = {"BB": 2, "CAIXA": 2, "ITAU": 2, "BANPARA": 2, "SANTANDER": None}
+
 # ==============================================================================
 # 0. CONFIGURAÇÃO DA PÁGINA E CSS
 # ==============================================================================
@@ -149,122 +172,122 @@ def identificar_banco(texto):
 # 2. MOTOR DE LEITURA DE PDF
 # ==============================================================================
 
-def encontrar_saldo_pdf(caminho_pdf):
+# --- REGRAS DE SALDO POR BANCO ---
+# Cada banco tem uma lista ordenada de estratégias (tipo, padrão compilado, condições); vale a primeira que encontrar.
+#   ultimo / primeiro / soma: valores capturados pelo padrão no texto
+#   ultimo_sem_aspas: idem, com as aspas removidas do texto
+#   linha_data: último valor da última linha iniciada por data
+#   mes_santander: linha do mês no quadro-resumo (a 2ª quando há 3 ou mais)
+# Condições: "aplic"/"mov" pelo nome do arquivo; "sem_lanc"/"com_lanc" pelo aviso de período sem lançamentos.
+RE_VALOR = re.compile(r"([\d\.]+,\d{2})")
+RE_DATA_COMPLETA = re.compile(r"^\s*\d{2}/\d{2}/\d{4}")
+RE_DATA_CURTA = re.compile(r"^\s*\d{2}/\d{2}")
+RE_MES = re.compile(r"^(janeiro|fevereiro|março|abril|maio|junho|julho|agosto|setembro|outubro|novembro|dezembro)\s+\d{4}", re.IGNORECASE)
+# Estratégias que tiram um único valor do fim do texto: só elas podem ser decididas pelas páginas finais
+ESTRATEGIAS_DO_FIM = {"ultimo", "ultimo_sem_aspas", "linha_data"}
+
+REGRAS_SALDO = {
+    "ITAU": [
+        ("ultimo", re.compile(r"(?:Saldo Líquido|TOTAL LIQUIDO P/RESGATE).*?([\d\.]+,\d{2})", re.IGNORECASE), ()),
+        ("ultimo", re.compile(r"\d{2}/\d{2}\s+SALDO\s+.*?([\d\.]+,\d{2})", re.IGNORECASE), ()),
+    ],
+    "SANTANDER": [
+        ("mes_santander", RE_MES, ()),
+        ("ultimo", re.compile(r"Saldo Bruto Final.*?([\d\.]+,\d{2})", re.IGNORECASE), ()),
+    ],
+    "BB": [
+        ("ultimo", re.compile(r"S\s+A\s+L\s+D\s+O.*?([\d\.]+,\d{2})", re.IGNORECASE), ("mov",)),
+        ("soma", re.compile(r"SALDO ATUAL[\s\n]*=[\s\n]*([\d\.]+,\d{2})", re.IGNORECASE), ()),
+        ("ultimo_sem_aspas", re.compile(r"SALDO ATUAL\s+([\d\.]+,\d{2})", re.IGNORECASE), ()),
+        ("linha_data", RE_DATA_COMPLETA, ()),
+        ("ultimo", re.compile(r"SALDO ATUAL.*?([\d\.]+,\d{2})", re.IGNORECASE), ()),
+    ],
+    "BANPARA": [
+        ("primeiro", re.compile(r"Saldo Conta Corrente.*?([\d\.]+,\d{2})", re.IGNORECASE | re.DOTALL), ("sem_lanc",)),
+        ("ultimo", re.compile(r"(?:SALDO PARA SAQUE|SALDO TOTAL|SALDO ATUAL|SALDO LÍQUIDO).*?([\d\.]+,\d{2})", re.IGNORECASE), ("com_lanc", "aplic")),
+        ("linha_data", RE_DATA_CURTA, ("com_lanc", "mov")),
+        ("ultimo", re.compile(r"(?:SALDO PARA SAQUE|SALDO TOTAL|SALDO ATUAL).*?([\d\.]+,\d{2})", re.IGNORECASE), ("com_lanc", "mov")),
+    ],
+    "CAIXA": [
+        ("linha_data", RE_DATA_COMPLETA, ("mov",)),
+        ("ultimo", re.compile(r"SALDO BRUTO.*?([\d\.]+,\d{2})", re.IGNORECASE), ("aplic",)),
+        ("ultimo", re.compile(r"SALDO DIA.*?([\d\.]+,\d{2})", re.IGNORECASE), ()),
+    ],
+}
+REGRAS_PADRAO = [
+    ("ultimo", re.compile(r"(?:Saldo Final|Total Disponível).*?([\d\.]+,\d{2})", re.IGNORECASE), ()),
+]
+
+def aplicar_estrategia(tipo, padrao, texto, linhas):
+    # Devolve (encontrou, saldo); encontrou=True encerra a busca do banco
+    if tipo == "linha_data":
+        for linha in reversed(linhas):
+            if padrao.match(linha):
+                valores = RE_VALOR.findall(linha)
+                if valores: return True, limpar_numero(valores[-1])
+        return False, None
+
+    if tipo == "mes_santander":
+        meses = [linha for linha in linhas if padrao.match(linha.strip())]
+        if not meses: return False, None
+        valores = RE_VALOR.findall(meses[1] if len(meses) >= 3 else meses[-1])
+        if len(valores) >= 8: return True, limpar_numero(valores[7])
+        return True, (limpar_numero(valores[-1]) if valores else None)
+
+    if tipo == "ultimo_sem_aspas": texto = texto.replace('"', '').replace("'", "")
+    valores = padrao.findall(texto)
+    if not valores: return False, None
+    if tipo == "soma": return True, sum(limpar_numero(v) for v in valores)
+    return True, limpar_numero(valores[0] if tipo == "primeiro" else valores[-1])
+
+def saldo_por_banco(texto_completo, banco, nome_arquivo, texto_final=None):
+    # None = saldo não encontrado neste texto.
+    # Com texto_final (só as últimas páginas), texto_completo é parcial (1ª + últimas): a regra de maior prioridade
+    # aplicável precisa ser uma estratégia do fim e achar o valor nas últimas páginas; senão, None (ler tudo).
+    # O aviso de período sem lançamentos vem no cabeçalho, então a 1ª página basta para as condições.
+    parcial = texto_final is not None
+    texto_limpo = texto_completo.upper().replace("Ã", "A").replace("Ç", "C")
+    sem_lanc = "NAO EXISTEM LANCAMENTOS NO PERIODO" in texto_limpo
+    condicoes = {"aplic" if "aplic" in nome_arquivo else "mov", "sem_lanc" if sem_lanc else "com_lanc"}
+    texto = texto_final if parcial else texto_completo
+    linhas = texto.split('\n')
+    for tipo, padrao, requisitos in REGRAS_SALDO.get(banco, REGRAS_PADRAO):
+        if not condicoes.issuperset(requisitos): continue
+        if parcial and tipo not in ESTRATEGIAS_DO_FIM: return None
+        encontrou, saldo = aplicar_estrategia(tipo, padrao, texto, linhas)
+        if encontrou: return saldo
+        if parcial: return None  # A regra pode casar nas páginas do meio, antes das de menor prioridade
+    return None
+
+def encontrar_saldo_pdf(pdf_bytes, nome_arquivo):
     try:
-        with pdfplumber.open(caminho_pdf) as pdf:
-            texto_completo = ""
-            for pagina in pdf.pages:
-                t = pagina.extract_text()
-                if t: texto_completo += "\n" + t
-
+        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+            paginas = pdf.pages
+            nome_arquivo = nome_arquivo.lower()
+            textos = {}
+
+            def texto_paginas(indices):
+                for i in indices:
+                    if i not in textos: textos[i] = paginas[i].extract_text() or ""
+                return "".join("\n" + textos[i] for i in indices if textos[i])
+
+            # 1ª página identifica o banco; o saldo fica nas últimas páginas
+            banco = identificar_banco(texto_paginas([0])) if paginas else "DESCONHECIDO"
+            n_finais = PAGINAS_FINAIS_POR_BANCO.get(banco)
+            if n_finais and len(paginas) > n_finais + 1:
+                finais = list(range(len(paginas) - n_finais, len(paginas)))
+                texto_parcial = texto_paginas([0] + finais)
+                banco = identificar_banco(texto_parcial)
+                saldo = saldo_por_banco(texto_parcial, banco, nome_arquivo, texto_final=texto_paginas(finais))
+                if saldo is not None: return saldo, banco
+
+            # Leitura completa: documento curto, banco sem estratégia ou saldo não achado no fim
+            texto_completo = texto_paginas(range(len(paginas)))
             if not texto_completo.strip(): return 0.0, "Imagem"
 
             banco = identificar_banco(texto_completo)
-            saldo = 0.0
-            nome_arquivo = os.path.basename(caminho_pdf).lower()
-            eh_aplicacao = "aplic" in nome_arquivo
-
-            if banco == "ITAU":
-                matches_invest = re.findall(r"(?:Saldo Líquido|TOTAL LIQUIDO P/RESGATE).*?([\d\.]+,\d{2})", texto_completo, re.IGNORECASE)
-                matches_mov = re.findall(r"\d{2}/\d{2}\s+SALDO\s+.*?([\d\.]+,\d{2})", texto_completo, re.IGNORECASE)
-                if matches_invest: saldo = limpar_numero(matches_invest[-1])
-                elif matches_mov: saldo = limpar_numero(matches_mov[-1])
-
-            elif banco == "SANTANDER":
-                linhas = texto_completo.split('\n')
-                meses_encontrados = []
-                padrao_mes = r"^(janeiro|fevereiro|março|abril|maio|junho|julho|agosto|setembro|outubro|novembro|dezembro)\s+\d{4}"
-                for linha in linhas:
-                    if re.match(padrao_mes, linha.strip(), re.IGNORECASE): meses_encontrados.append(linha)
-                
-                linha_alvo = ""
-                if len(meses_encontrados) >= 3: linha_alvo = meses_encontrados[1] 
-                elif len(meses_encontrados) == 2: linha_alvo = meses_encontrados[-1] 
-                elif len(meses_encontrados) == 1: linha_alvo = meses_encontrados[0]
-
-                if linha_alvo:
-                    valores = re.findall(r"([\d\.]+,\d{2})", linha_alvo)
-                    if len(valores) >= 8: saldo = limpar_numero(valores[7])
-                    elif valores: saldo = limpar_numero(valores[-1])
-                else:
-                    matches = re.findall(r"Saldo Bruto Final.*?([\d\.]+,\d{2})", texto_completo, re.IGNORECASE)
-                    if matches: saldo = limpar_numero(matches[-1])
-
-            elif banco == "BB":
-                texto_sem_aspas = texto_completo.replace('"', '').replace("'", "")
-                saldo_encontrado = False
-                if not eh_aplicacao:
-                    matches_saldo_espacado = re.findall(r"S\s+A\s+L\s+D\s+O.*?([\d\.]+,\d{2})", texto_completo, re.IGNORECASE)
-                    if matches_saldo_espacado:
-                        saldo = limpar_numero(matches_saldo_espacado[-1])
-                        saldo_encontrado = True
-
-                if not saldo_encontrado:
-                    matches_resumo = re.findall(r"SALDO ATUAL[\s\n]*=[\s\n]*([\d\.]+,\d{2})", texto_completo, re.IGNORECASE)
-                    matches_invest = re.findall(r"SALDO ATUAL\s+([\d\.]+,\d{2})", texto_sem_aspas, re.IGNORECASE)
-
-                    if matches_resumo: saldo = sum(limpar_numero(v) for v in matches_resumo)
-                    elif matches_invest: saldo = limpar_numero(matches_invest[-1])
-                    else:
-                        linhas = texto_completo.split('\n')
-                        saldo_encontrado_bb = None
-                        padrao_data = r"^\s*\d{2}/\d{2}/\d{4}"
-                        for linha in linhas:
-                            if re.match(padrao_data, linha):
-                                valores = re.findall(r"([\d\.]+,\d{2})[CD]?", linha)
-                                if valores: saldo_encontrado_bb = limpar_numero(valores[-1])
-                        if saldo_encontrado_bb is not None: saldo = saldo_encontrado_bb
-                        else:
-                            matches_res = re.findall(r"SALDO ATUAL.*?([\d\.]+,\d{2})", texto_completo, re.IGNORECASE)
-                            if matches_res: saldo = limpar_numero(matches_res[-1])
-
-            elif banco == "BANPARA":
-                texto_limpo = texto_completo.upper().replace("Ã", "A").replace("Ç", "C")
-                if "NAO EXISTEM LANCAMENTOS NO PERIODO" in texto_limpo:
-                    matches_vazio = re.findall(r"Saldo Conta Corrente.*?([\d\.]+,\d{2})", texto_completo, re.IGNORECASE | re.DOTALL)
-                    if matches_vazio: saldo = limpar_numero(matches_vazio[0])
-                    else: saldo = 0.0
-                elif "aplic" in nome_arquivo:
-                    matches = re.findall(r"(?:SALDO PARA SAQUE|SALDO TOTAL|SALDO ATUAL|SALDO LÍQUIDO).*?([\d\.]+,\d{2})", texto_completo, re.IGNORECASE)
-                    if matches: saldo = limpar_numero(matches[-1])
-                else:
-                    linhas = texto_completo.split('\n')
-                    saldo_encontrado_banpara = None
-                    padrao_data = r"^\s*\d{2}/\d{2}"
-                    for linha in linhas:
-                        if re.match(padrao_data, linha):
-                            valores = re.findall(r"([\d\.]+,\d{2})", linha)
-                            if valores: saldo_encontrado_banpara = limpar_numero(valores[-1])
-                    if saldo_encontrado_banpara is not None: saldo = saldo_encontrado_banpara
-                    else:
-                        matches = re.findall(r"(?:SALDO PARA SAQUE|SALDO TOTAL|SALDO ATUAL).*?([\d\.]+,\d{2})", texto_completo, re.IGNORECASE)
-                        if matches: saldo = limpar_numero(matches[-1])
-
-            elif banco == "CAIXA":
-                if "aplic" not in nome_arquivo:
-                    linhas = texto_completo.split('\n')
-                    saldo_encontrado_caixa = None
-                    padrao_data = r"^\s*\d{2}/\d{2}/\d{4}"
-                    for linha in linhas:
-                        if re.match(padrao_data, linha):
-                            valores = re.findall(r"([\d\.]+,\d{2})[CD]?", linha)
-                            if valores: saldo_encontrado_caixa = limpar_numero(valores[-1])
-                    if saldo_encontrado_caixa is not None: saldo = saldo_encontrado_caixa
-                    else:
-                        matches_dia = re.findall(r"SALDO DIA.*?([\d\.]+,\d{2})", texto_completo, re.IGNORECASE)
-                        if matches_dia: saldo = limpar_numero(matches_dia[-1])
-                else:
-                    matches_bruto = re.findall(r"SALDO BRUTO.*?([\d\.]+,\d{2})", texto_completo, re.IGNORECASE)
-                    if matches_bruto: saldo = limpar_numero(matches_bruto[-1])
-                    else:
-                        matches_dia = re.findall(r"SALDO DIA.*?([\d\.]+,\d{2})", texto_completo, re.IGNORECASE)
-                        if matches_dia: saldo = limpar_numero(matches_dia[-1])
-
-            else:
-                matches = re.findall(r"(?:Saldo Final|Total Disponível).*?([\d\.]+,\d{2})", texto_completo, re.IGNORECASE)
-                if matches: saldo = limpar_numero(matches[-1])
-
-            return saldo, banco
+            saldo = saldo_por_banco(texto_completo, banco, nome_arquivo)
+            return (saldo if saldo is not None else 0.0), banco
     except:
         return 0.0, "Erro"
 
@@ -273,93 +296,321 @@ def encontrar_saldo_pdf(caminho_pdf):
 # ==============================================================================
 
 def ler_planilha_e_consolidar(file_obj):
-    import unicodedata
-    
-    def normalizar(txt):
-        if pd.isna(txt): return ""
-        txt_str = str(txt).lower().strip()
-        nfkd = unicodedata.normalize('NFKD', txt_str)
+    def normalizar(txt_str):
+        nfkd = unicodedata.normalize('NFKD', txt_str.lower().strip())
         return "".join([c for c in nfkd if not unicodedata.combining(c)])
 
+    def normalizar_coluna(col):
+        # Cada valor distinto da coluna é normalizado uma única vez
+        textos = col.astype(str)
+        mapa = {t: normalizar(t) for t in textos.unique()}
+        return textos.map(mapa).where(col.notna(), "")
+
     try:
         df_raw = pd.read_excel(file_obj, header=None, engine='openpyxl', dtype=object)
     except Exception as e:
         st.error(f"Erro ao ler planilha: {e}")
         return {}
 
+    if df_raw.empty: return {}
+    df_norm = df_raw.apply(normalizar_coluna)
+    linhas_texto = df_norm.iloc[:, 0].str.cat([df_norm[c] for c in df_norm.columns[1:]], sep=" ")
+
     idx_header = -1
     col_map = {}
     
-    for i, row in df_raw.head(30).iterrows():
-        row_str = " ".join([normalizar(x) for x in row.values])
-        if "conta" in row_str and ("saldo" in row_str and "contabil" in row_str):
-            idx_header = i
-            for col_idx, val in enumerate(row.values):
-                val_str = normalizar(val)
-                if val_str == "conta": 
-                    col_map['CODIGO'] = col_idx
-                elif "descri" in val_str: 
-                    col_map['DESCRICAO'] = col_idx
-                elif "banco" in val_str and "conta" in val_str: 
-                    col_map['CONTA_BANCO'] = col_idx
-                elif "saldo" in val_str and "contabil" in val_str:
-                    col_map['RAZAO'] = col_idx
-            break
+    cabecalho = linhas_texto.head(30)
+    eh_cabecalho = cabecalho.str.contains("conta", regex=False) & cabecalho.str.contains("saldo", regex=False) & cabecalho.str.contains("contabil", regex=False)
+    if eh_cabecalho.any():
+        idx_header = eh_cabecalho.idxmax()
+        for col_idx, val_str in enumerate(df_norm.loc[idx_header]):
+            if val_str == "conta": 
+                col_map['CODIGO'] = col_idx
+            elif "descri" in val_str: 
+                col_map['DESCRICAO'] = col_idx
+            elif "banco" in val_str and "conta" in val_str: 
+                col_map['CONTA_BANCO'] = col_idx
+            elif "saldo" in val_str and "contabil" in val_str:
+                col_map['RAZAO'] = col_idx
             
     if idx_header == -1 or not col_map:
         idx_header = 9
         col_map = {'CODIGO': 0, 'DESCRICAO': 2, 'CONTA_BANCO': 7, 'RAZAO': 11}
 
-    dados_consolidados = {} 
-    grupo_atual = "MOVIMENTO"
+    if max(col_map.values()) >= df_raw.shape[1]: return {}
+    if not {'CODIGO', 'DESCRICAO', 'CONTA_BANCO', 'RAZAO'} <= col_map.keys(): return {}
 
-    for index, row in df_raw.iloc[idx_header+1:].iterrows():
-        if not col_map or max(col_map.values()) >= len(row): continue
+    corpo = df_raw.iloc[idx_header+1:]
+    texto = linhas_texto.iloc[idx_header+1:]
 
-        linha_texto = " ".join([normalizar(x) for x in row.values]).lower()
-        if "conta movimento" in linha_texto: grupo_atual = "MOVIMENTO"; continue
-        elif "conta aplicacao" in linha_texto: grupo_atual = "APLICACAO"; continue
-        
-        try:
-            conta_raw = str(row[col_map['CONTA_BANCO']]).strip()
-            codigo = str(row[col_map['CODIGO']]).strip()
-            
-            if not codigo or codigo.lower() == 'nan' or "banco" in conta_raw.lower(): continue
+    # Linhas de seção definem o grupo das linhas seguintes (forward-fill)
+    secao = pd.Series(None, index=texto.index, dtype=object)
+    secao[texto.str.contains("conta aplicacao", regex=False)] = "APLICACAO"
+    secao[texto.str.contains("conta movimento", regex=False)] = "MOVIMENTO"
+    eh_secao = secao.notna()
+    grupo = pd.Series(["MOVIMENTO"] + secao[eh_secao].tolist()).iloc[eh_secao.cumsum()].set_axis(secao.index)
 
-            numeros_conta_match = limpar_conta_excel(conta_raw)
-            numeros_conta_full = extrair_digitos(conta_raw)
-
-            if codigo.isdigit() and len(conta_raw) > 3:
-                descricao = str(row[col_map['DESCRICAO']]).strip()
-                valor_final = limpar_numero(row[col_map['RAZAO']])
-                chave = (numeros_conta_full, grupo_atual)
+    conta_raw = corpo[col_map['CONTA_BANCO']].astype(str).str.strip()
+    codigo = corpo[col_map['CODIGO']].astype(str).str.strip()
+    validas = (
+        ~eh_secao & (codigo != "") & (codigo.str.lower() != 'nan') & ~conta_raw.str.lower().str.contains("banco", regex=False)
+        & codigo.str.isdigit() & (conta_raw.str.len() > 3)
+    )
+    if not validas.any(): return {}
+
+    df = pd.DataFrame({
+        "CONTA_FULL": conta_raw[validas].map(extrair_digitos),
+        "GRUPO": grupo[validas],
+        "CÓDIGO": codigo[validas],
+        "DESCRIÇÃO": corpo.loc[validas, col_map['DESCRICAO']].astype(str).str.strip(),
+        "CONTA": conta_raw[validas],
+        "RAZÃO": corpo.loc[validas, col_map['RAZAO']].map(limpar_numero).astype(float),
+        "MATCH_KEY": conta_raw[validas].map(limpar_conta_excel),
+    })
+
+    # Mesma conta no mesmo grupo: soma o razão e mantém os dados da primeira linha
+    consolidado = df.groupby(["CONTA_FULL", "GRUPO"], sort=False).agg({
+        "CÓDIGO": "first", "DESCRIÇÃO": "first", "CONTA": "first", "RAZÃO": "sum", "MATCH_KEY": "first"
+    })
+    return {
+        chave: {
+            "CÓDIGO": cod, "DESCRIÇÃO": desc, "CONTA": conta, "RAZÃO": float(razao), "GRUPO": chave[1],
+            "EXTRATO": 0.0, "ARQUIVO_ORIGEM": "", "TEM_PDF": False, "MATCH_KEY": match_key, "UG": "N/D"
+        }
+        for chave, cod, desc, conta, razao, match_key in zip(
+            consolidado.index, consolidado["CÓDIGO"], consolidado["DESCRIÇÃO"], consolidado["CONTA"], consolidado["RAZÃO"], consolidado["MATCH_KEY"]
+        )
+    }
 
-                if chave in dados_consolidados:
-                    dados_consolidados[chave]['RAZÃO'] += valor_final
-                    if descricao not in dados_consolidados[chave]['DESCRICAO']:
-                         dados_consolidados[chave]['DESCRICAO'] += f" / {descricao}"
-                else:
-                    dados_consolidados[chave] = {
-                        "CÓDIGO": codigo,
-                        "DESCRIÇÃO": descricao,
-                        "CONTA": conta_raw,
-                        "RAZÃO": valor_final,
-                        "GRUPO": grupo_atual,
-                        "EXTRATO": 0.0,
-                        "ARQUIVO_ORIGEM": "",
-                        "TEM_PDF": False,
-                        "MATCH_KEY": numeros_conta_match,
-                        "UG": "N/D"
-                    }
-        except: continue
-    return dados_consolidados
-
-def processar_pdf_worker(item):
-    saldo, _ = encontrar_saldo_pdf(item['caminho'])
-    item['saldo'] = saldo
-    return item
-
-def processar_confronto(pasta_extratos, dados_dict):
+class RarSolidoExtraido:
+    # Rar sólido: ler um membro obriga o unrar a descompactar o arquivo desde o início (e a copiá-lo para disco).
+    # Aqui ele é descompactado uma única vez, em ordem, e cada membro fica numa pasta temporária até o close().
+    BLOCO = 1024 * 1024
+
+    def __init__(self, arquivo_rar, file_bytes):
+        self.arquivo_rar = arquivo_rar
+        self.pasta = tempfile.mkdtemp(prefix="saldos_rar_")
+        self.caminhos = {}
+        try: self._extrair(file_bytes)
+        except Exception: pass  # Membros não extraídos são lidos um a um pelo rarfile
+
+    def _extrair(self, file_bytes):
+        caminho_rar = os.path.join(self.pasta, "origem.rar")
+        with open(caminho_rar, "wb") as f: f.write(file_bytes)
+        # Sem nome de membro, o comando de leitura do rarfile imprime todos os arquivos em sequência
+        cmd = rarfile.tool_setup().open_cmdline(None, caminho_rar)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            for n, info in enumerate(m for m in self.arquivo_rar.infolist() if m.is_file()):
+                destino = os.path.join(self.pasta, f"{n}.bin")
+                crc, restante = 0, info.file_size
+                with open(destino, "wb") as f:
+                    while restante > 0:
+                        bloco = proc.stdout.read(min(self.BLOCO, restante))
+                        if not bloco: return
+                        crc = zlib.crc32(bloco, crc)
+                        f.write(bloco)
+                        restante -= len(bloco)
+                # CRC diferente = saída fora de sincronia com a lista de membros: o restante fica com o rarfile
+                if info.CRC is not None and crc != info.CRC: return
+                self.caminhos[info.filename] = destino
+        finally:
+            proc.kill(); proc.wait(); proc.stdout.close()
+            os.remove(caminho_rar)
+
+    def infolist(self):
+        return self.arquivo_rar.infolist()
+
+    def read(self, info):
+        caminho = self.caminhos.get(info.filename)
+        if caminho is None: return self.arquivo_rar.read(info)
+        with open(caminho, "rb") as f: return f.read()
+
+    def close(self):
+        shutil.rmtree(self.pasta, ignore_errors=True)
+        self.arquivo_rar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def abrir_compactado(nome, file_bytes):
+    # O arquivo enviado é lido direto da memória (o rar só usa disco no que o unrar exigir)
+    if nome.lower().endswith('.rar'):
+        arquivo = rarfile.RarFile(io.BytesIO(file_bytes))
+        return RarSolidoExtraido(arquivo, file_bytes) if arquivo.is_solid() else arquivo
+    return zipfile.ZipFile(io.BytesIO(file_bytes))
+
+def listar_pdfs_compactado(arquivo):
+    # (ug, nome, leitor): a pasta do PDF vira a UG; o conteúdo só é lido quando o PDF vai para o worker
+    for info in arquivo.infolist():
+        caminho = info.filename.replace('\\', '/')
+        if info.is_dir() or "__MACOSX" in caminho or not caminho.lower().endswith('.pdf'): continue
+        pasta, nome = os.path.split(caminho)
+        yield os.path.basename(pasta) or "Raiz", nome, functools.partial(arquivo.read, info)
+
+def ler_saldo_cronometrado(pdf_bytes, nome):
+    inicio = time.perf_counter()
+    saldo, banco = encontrar_saldo_pdf(pdf_bytes, nome)
+    return saldo, banco, time.perf_counter() - inicio
+
+def laco_worker_saldo(conn):
+    # Processo filho: recebe (idx, bytes, nome) até receber None
+    while True:
+        tarefa = conn.recv()
+        if tarefa is None: break
+        idx, pdf_bytes, nome = tarefa
+        conn.send((idx, *ler_saldo_cronometrado(pdf_bytes, nome)))
+
+def abrir_cache_saldos():
+    try:
+        cache = sqlite3.connect(CACHE_SALDOS, timeout=10)
+        cache.execute("CREATE TABLE IF NOT EXISTS saldos (hash TEXT PRIMARY KEY, saldo REAL, banco TEXT, usado REAL)")
+        cache.execute("DELETE FROM saldos WHERE usado < ?", (time.time() - CACHE_SALDOS_DIAS * 86400,))
+        return cache
+    except Exception:
+        return None  # Sem cache (ex.: disco somente leitura): tudo é lido normalmente
+
+def consultar_cache_saldo(cache, item, pdf_bytes):
+    # A chave inclui a versão das regras e "aplic" no nome, que muda as regras aplicadas ao mesmo conteúdo
+    h = hashlib.sha256(f"v{VERSAO_REGRAS_SALDO}\0".encode())
+    h.update(pdf_bytes + (b"aplic" if "aplic" in item['nome'].lower() else b""))
+    item['hash'] = h.hexdigest()
+    if cache is None: return None
+    try:
+        linha = cache.execute("SELECT saldo, banco FROM saldos WHERE hash = ?", (item['hash'],)).fetchone()
+        if linha: cache.execute("UPDATE saldos SET usado = ? WHERE hash = ?", (time.time(), item['hash']))
+        return linha
+    except Exception:
+        return None
+
+def gravar_cache_saldo(cache, item, saldo, banco):
+    if cache is None or 'hash' not in item: return
+    try: cache.execute("INSERT OR REPLACE INTO saldos VALUES (?, ?, ?, ?)", (item['hash'], saldo, banco, time.time()))
+    except Exception: pass
+
+def extrair_saldos_processos(itens, n_processos=N_PROCESSOS, tempo_limite=TEMPO_LIMITE_PDF, cache=None):
+    # Gera (idx, saldo, banco, tempo, status) conforme cada arquivo termina.
+    # Arquivo que trava ou derruba o processo: só ele é perdido, e o processo é descartado.
+    # Processos próprios (e não o executor_processos) para poder descartar o que passar do tempo limite;
+    # fork pelo mesmo motivo do executor_processos do Conciliador Bancário.
+    ctx = multiprocessing.get_context("fork")
+    n_processos = max(1, min(n_processos, len(itens)))
+
+    def novo_worker():
+        conn_pai, conn_filho = ctx.Pipe()
+        proc = ctx.Process(target=laco_worker_saldo, args=(conn_filho,), daemon=True)
+        proc.start()
+        conn_filho.close()
+        return conn_pai, proc
+
+    fila = deque(range(len(itens)))
+    workers = {}   # conn -> processo (criados sob demanda)
+    ocupados = {}  # conn -> (idx, início)
+    try:
+        while fila or ocupados:
+            while fila and len(ocupados) < n_processos:
+                idx = fila.popleft()
+                try: pdf_bytes = itens[idx]['ler']()
+                except Exception:
+                    yield idx, 0.0, "Erro", 0.0, "Falha ao descompactar"
+                    continue
+                em_cache = consultar_cache_saldo(cache, itens[idx], pdf_bytes)
+                if em_cache:
+                    yield idx, *em_cache, 0.0, "Cache"
+                    continue
+                conn = next((c for c in workers if c not in ocupados), None)
+                if conn is None:
+                    conn, proc = novo_worker()
+                    workers[conn] = proc
+                conn.send((idx, pdf_bytes, itens[idx]['nome']))
+                ocupados[conn] = (idx, time.perf_counter())
+            if not ocupados: continue
+
+            prazo = min(inicio for _, inicio in ocupados.values()) + tempo_limite
+            perdidos = []
+            for conn in wait(list(ocupados), timeout=max(0, prazo - time.perf_counter())):
+                idx, inicio = ocupados.pop(conn)
+                try:
+                    yield (*conn.recv(), "OK")
+                except (EOFError, OSError):
+                    perdidos.append(conn)
+                    yield idx, 0.0, "Erro", time.perf_counter() - inicio, "Processo encerrado"
+
+            agora = time.perf_counter()
+            for conn, (idx, inicio) in list(ocupados.items()):
+                if agora - inicio >= tempo_limite:
+                    del ocupados[conn]
+                    perdidos.append(conn)
+                    yield idx, 0.0, "Timeout", agora - inicio, "Tempo esgotado"
+
+            for conn in perdidos:
+                proc = workers.pop(conn)
+                proc.kill(); proc.join(); conn.close()
+    finally:
+        for conn, proc in workers.items():
+            try: conn.send(None)
+            except Exception: pass
+        for conn, proc in workers.items():
+            proc.join(timeout=1)
+            if proc.is_alive(): proc.kill()
+            conn.close()
+
+def extrair_saldos_threads(itens, cache=None):
+    # Sem fork (ex.: Windows): threads, sem limite de tempo por arquivo
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futuros = {}
+        for idx, item in enumerate(itens):
+            try: pdf_bytes = item['ler']()
+            except Exception:
+                yield idx, 0.0, "Erro", 0.0, "Falha ao descompactar"
+                continue
+            em_cache = consultar_cache_saldo(cache, item, pdf_bytes)
+            if em_cache: yield idx, *em_cache, 0.0, "Cache"
+            else: futuros[executor.submit(ler_saldo_cronometrado, pdf_bytes, item['nome'])] = idx
+        for futuro in as_completed(futuros):
+            yield (futuros[futuro], *futuro.result(), "OK")
+
+def extrair_saldos(itens):
+    # Só PDFs novos ou alterados vão para os workers; os demais saem do cache
+    cache = abrir_cache_saldos()
+    try:
+        if "fork" in multiprocessing.get_all_start_methods(): origem = extrair_saldos_processos(itens, cache=cache)
+        else: origem = extrair_saldos_threads(itens, cache=cache)
+        for idx, saldo, banco, tempo, status in origem:
+            if status == "OK" and banco != "Erro": gravar_cache_saldo(cache, itens[idx], saldo, banco)
+            yield idx, saldo, banco, tempo, status
+    finally:
+        if cache is not None:
+            cache.commit()
+            cache.close()
+
+def indexar_contas(dados_dict, chaves_existentes):
+    # Por grupo: MATCH_KEY -> posições em chaves_existentes, e cada trecho (>= 4 dígitos) da MATCH_KEY -> posições
+    indice = {}
+    for pos, chave in enumerate(chaves_existentes):
+        match_key = dados_dict[chave]['MATCH_KEY']
+        exatas, trechos = indice.setdefault(chave[1], ({}, {}))
+        exatas.setdefault(match_key, []).append(pos)
+        for i in range(len(match_key)):
+            for j in range(i + 4, len(match_key) + 1):
+                lista = trechos.setdefault(match_key[i:j], [])
+                if not lista or lista[-1] != pos: lista.append(pos)
+    return indice
+
+def candidatos_conta(numeros, grupo, indice):
+    # Contas do grupo cuja MATCH_KEY contém os dígitos do PDF ou está contida neles, na ordem de chaves_existentes
+    if len(numeros) < 4 or grupo not in indice: return []
+    exatas, trechos = indice[grupo]
+    posicoes = set(trechos.get(numeros, ()))
+    for i in range(len(numeros) + 1):
+        for j in range(i, len(numeros) + 1):
+            posicoes.update(exatas.get(numeros[i:j], ()))
+    return sorted(posicoes)
+
+def processar_confronto(arquivos_pdf, dados_dict, ao_ler_pdf=None):
     chaves_existentes = sorted(
         list(dados_dict.keys()), 
         key=lambda k: len(dados_dict[k]['MATCH_KEY']), 
@@ -369,43 +620,70 @@ def processar_confronto(pasta_extratos, dados_dict):
     arquivos_aplicacao = []
     arquivos_movimento = []
 
-    for root, dirs, files in os.walk(pasta_extratos):
-        if "__MACOSX" in root: continue
-        nome_ug = os.path.basename(root)
-        if root == pasta_extratos: nome_ug = "Raiz"
-
-        for file in files:
-            if file.lower().endswith('.pdf'):
-                item = {
-                    'caminho': os.path.join(root, file),
-                    'nome': file,
-                    'ug': nome_ug,
-                    'numeros': extrair_digitos(file),
-                    'processado': False,
-                    'saldo': 0.0
-                }
-                if "aplic" in file.lower(): arquivos_aplicacao.append(item)
-                else: arquivos_movimento.append(item)
+    for nome_ug, file, leitor in arquivos_pdf:
+        item = {
+            'ler': leitor,
+            'nome': file,
+            'ug': nome_ug,
+            'numeros': extrair_digitos(file),
+            'processado': False,
+            'saldo': 0.0
+        }
+        if "aplic" in file.lower(): arquivos_aplicacao.append(item)
+        else: arquivos_movimento.append(item)
+
+    # Índice dos dígitos das contas: cada PDF vai direto às contas candidatas.
+    # Desempate: ordem de chaves_existentes (MATCH_KEY mais longa primeiro, depois ordem da planilha)
+    indice = indexar_contas(dados_dict, chaves_existentes)
+    ambiguos = []
+
+    def linha_parcial(pdf, grupo):
+        # Associação provisória, só com a conta principal; o resultado final é montado após a leitura completa
+        diferenca_pdf = round(0.0 - pdf['saldo'], 2)
+        candidatas = candidatos_conta(pdf['numeros'], grupo, indice)
+        if not candidatas:
+            return None, {
+                "UG": pdf['ug'], "CÓDIGO": "N/A", "DESCRIÇÃO": "PDF sem conta no Excel",
+                "CONTA": pdf['nome'], "RAZÃO": 0.0, "GRUPO": grupo,
+                "EXTRATO": pdf['saldo'], "DIFERENÇA": 0.0 if abs(diferenca_pdf) < 0.01 else diferenca_pdf, "ARQUIVO_ORIGEM": pdf['nome']
+            }
+        chave = chaves_existentes[candidatas[0]]
+        dados = dados_dict[chave]
+        diferenca = round(dados['RAZÃO'] - pdf['saldo'], 2)
+        return chave, {
+            "UG": pdf['ug'], "CÓDIGO": dados['CÓDIGO'], "DESCRIÇÃO": dados['DESCRIÇÃO'],
+            "CONTA": dados['CONTA'], "RAZÃO": dados['RAZÃO'], "GRUPO": grupo,
+            "EXTRATO": pdf['saldo'], "DIFERENÇA": 0.0 if abs(diferenca) < 0.01 else diferenca, "ARQUIVO_ORIGEM": pdf['nome']
+        }
 
     all_files = arquivos_aplicacao + arquivos_movimento
+    parciais = {}  # conta (ou PDF sem conta) -> (posição do PDF, linha provisória); vale o último PDF da lista, como no resultado final
     if all_files:
-        with ThreadPoolExecutor(max_workers=2) as executor:
-            results = list(executor.map(processar_pdf_worker, all_files))
-        arquivos_aplicacao = results[:len(arquivos_aplicacao)]
-        arquivos_movimento = results[len(arquivos_aplicacao):]
+        for lidos, (idx, saldo, banco, tempo, status) in enumerate(extrair_saldos(all_files), start=1):
+            all_files[idx].update({'saldo': saldo, 'banco': banco, 'tempo': tempo, 'status': status})
+            if ao_ler_pdf is None: continue
+            chave, linha = linha_parcial(all_files[idx], "APLICACAO" if idx < len(arquivos_aplicacao) else "MOVIMENTO")
+            chave = chave or ("PDF", idx)
+            if chave not in parciais or parciais[chave][0] < idx: parciais[chave] = (idx, linha)
+            ao_ler_pdf(lidos, len(all_files), [linha for _, linha in parciais.values()])
+
+    def associar(pdf, chave, sufixo, candidatas):
+        dados = dados_dict[chave]
+        if len(candidatas) > 1:
+            outras = ", ".join(dados_dict[chaves_existentes[p]]['CONTA'] for p in candidatas[1:])
+            ambiguos.append({"ARQUIVO": pdf['nome'], "UG": pdf['ug'], "GRUPO": chave[1], "CONTA ESCOLHIDA": dados['CONTA'], "MOTIVO": f"Outras contas candidatas: {outras}"})
+        if dados['TEM_PDF']:
+            ambiguos.append({"ARQUIVO": pdf['nome'], "UG": pdf['ug'], "GRUPO": chave[1], "CONTA ESCOLHIDA": dados['CONTA'], "MOTIVO": f"Substitui o extrato {dados['ARQUIVO_ORIGEM']}"})
+        dados['EXTRATO'] = pdf['saldo']
+        dados['ARQUIVO_ORIGEM'] = pdf['nome'] + sufixo
+        dados['UG'] = pdf['ug']
+        dados['TEM_PDF'] = True
+        pdf['processado'] = True
 
     def match_pdf(pdf_list, grupo_alvo):
         for pdf in pdf_list:
-            for (conta_excel, grupo_excel) in chaves_existentes:
-                if grupo_excel == grupo_alvo:
-                    match_key = dados_dict[(conta_excel, grupo_excel)]['MATCH_KEY']
-                    if len(pdf['numeros']) >= 4 and (pdf['numeros'] in match_key or match_key in pdf['numeros']):
-                        dados_dict[(conta_excel, grupo_excel)]['EXTRATO'] = pdf['saldo']
-                        dados_dict[(conta_excel, grupo_excel)]['ARQUIVO_ORIGEM'] = pdf['nome']
-                        dados_dict[(conta_excel, grupo_excel)]['UG'] = pdf['ug']
-                        dados_dict[(conta_excel, grupo_excel)]['TEM_PDF'] = True
-                        pdf['processado'] = True
-                        break
+            candidatas = candidatos_conta(pdf['numeros'], grupo_alvo, indice)
+            if candidatas: associar(pdf, chaves_existentes[candidatas[0]], "", candidatas)
     
     match_pdf(arquivos_aplicacao, "APLICACAO")
     match_pdf(arquivos_movimento, "MOVIMENTO")
@@ -413,16 +691,8 @@ def processar_confronto(pasta_extratos, dados_dict):
     for pdf in arquivos_aplicacao + arquivos_movimento:
         if not pdf['processado']:
             grupo_pdf = "APLICACAO" if "aplic" in pdf['nome'].lower() else "MOVIMENTO"
-            for (conta_excel, grupo_excel) in chaves_existentes:
-                if grupo_excel == grupo_pdf and not dados_dict[(conta_excel, grupo_excel)]['TEM_PDF']:
-                    match_key = dados_dict[(conta_excel, grupo_excel)]['MATCH_KEY']
-                    if len(pdf['numeros']) >= 4 and (pdf['numeros'] in match_key or match_key in pdf['numeros']):
-                        dados_dict[(conta_excel, grupo_excel)]['EXTRATO'] = pdf['saldo']
-                        dados_dict[(conta_excel, grupo_excel)]['ARQUIVO_ORIGEM'] = pdf['nome'] + " (Repescagem)"
-                        dados_dict[(conta_excel, grupo_excel)]['UG'] = pdf['ug']
-                        dados_dict[(conta_excel, grupo_excel)]['TEM_PDF'] = True
-                        pdf['processado'] = True
-                        break
+            candidatas = [p for p in candidatos_conta(pdf['numeros'], grupo_pdf, indice) if not dados_dict[chaves_existentes[p]]['TEM_PDF']]
+            if candidatas: associar(pdf, chaves_existentes[candidatas[0]], " (Repescagem)", candidatas)
 
     lista_final = []
     for chave, dados in dados_dict.items():
@@ -442,7 +712,14 @@ def processar_confronto(pasta_extratos, dados_dict):
                 "EXTRATO": pdf['saldo'], "DIFERENÇA": diferenca, "ARQUIVO_ORIGEM": pdf['nome']
             })
 
-    return pd.DataFrame(lista_final)
+    df_leitura = pd.DataFrame([
+        {"UG": pdf['ug'], "ARQUIVO": pdf['nome'], "BANCO": pdf['banco'], "STATUS": pdf['status'], "TEMPO (s)": round(pdf['tempo'], 2)}
+        for pdf in all_files
+    ], columns=["UG", "ARQUIVO", "BANCO", "STATUS", "TEMPO (s)"])
+
+    df_ambiguos = pd.DataFrame(ambiguos, columns=["ARQUIVO", "UG", "GRUPO", "CONTA ESCOLHIDA", "MOTIVO"])
+
+    return pd.DataFrame(lista_final), df_leitura, df_ambiguos
 
 # ==============================================================================
 # 4. FUNÇÕES DE GERAÇÃO DE RELATÓRIOS (EXCEL E PDF)
@@ -471,41 +748,48 @@ def aplicar_estilo_excel(ws, wb, df, start_row, cols):
         else:
             ws.set_column(i, i, width=largura_final)
 
-def gerar_pdf_conciliacao(df_final):
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4), 
-                            rightMargin=10*mm, leftMargin=10*mm, topMargin=15*mm, bottomMargin=15*mm,
-                            title="Relatorio_Conciliacao.pdf")
-    story = []
+def criar_estilos_pdf():
     styles = getSampleStyleSheet()
-    title_style = styles["Title"]
-    title_style.alignment = 1
+    titulo = styles["Title"]
+    titulo.alignment = 1
+    card_valor = ParagraphStyle(name='CardValue', parent=styles['Normal'], fontName='Helvetica-Bold', fontSize=16, alignment=1, spaceBefore=4, spaceAfter=4)
+    return {
+        "titulo": titulo,
+        "card_titulo": ParagraphStyle(name='CardTitle', parent=styles['Normal'], fontName='Helvetica-Bold', fontSize=9, alignment=1, textColor=colors.darkgray),
+        "card_valor_ok": ParagraphStyle(name='V', parent=card_valor, textColor=colors.green),
+        "card_valor_pendente": ParagraphStyle(name='V', parent=card_valor, textColor=colors.red),
+        "card_label": ParagraphStyle(name='CardLabel', parent=styles['Normal'], fontName='Helvetica', fontSize=8, alignment=1, textColor=colors.gray),
+        "secao": ParagraphStyle(name='SectionHeader', parent=styles['Heading2'], fontName='Helvetica-Bold', fontSize=12, alignment=0, textColor=colors.white, backColor=colors.black, padding=8, borderPadding=6),
+        "detalhe": ParagraphStyle(name='DescTiny', fontSize=7),
+    }
+
+# Estilos criados uma vez e compartilhados por todas as seções (e pelos processos filhos)
+ESTILOS_PDF = criar_estilos_pdf()
+VALORES_CAIXA = {'PMB': 86.65, 'FMAS': 7.06, 'FME': 4614.80}
 
-    story.append(Paragraph("Relatório de Conciliação de Saldos Bancários", title_style))
-    story.append(Spacer(1, 10*mm))
+def ordenar_ugs(ugs):
+    return sorted(ugs, key=lambda x: 'ZZZZZ' if x == 'N/D' else x)
 
-    st_card_title = ParagraphStyle(name='CardTitle', parent=styles['Normal'], fontName='Helvetica-Bold', fontSize=9, alignment=1, textColor=colors.darkgray)
-    st_card_value = ParagraphStyle(name='CardValue', parent=styles['Normal'], fontName='Helvetica-Bold', fontSize=16, alignment=1, spaceBefore=4, spaceAfter=4)
-    st_card_label = ParagraphStyle(name='CardLabel', parent=styles['Normal'], fontName='Helvetica', fontSize=8, alignment=1, textColor=colors.gray)
+def story_capa_pdf(df_final):
+    est = ESTILOS_PDF
+    story = [Paragraph("Relatório de Conciliação de Saldos Bancários", est["titulo"]), Spacer(1, 10*mm)]
 
     # ==========================================
     # 1. CARDS DE RESUMO NO PDF
     # ==========================================
-    ugs_unicas = sorted(df_final['UG'].unique(), key=lambda x: 'ZZZZZ' if x == 'N/D' else x)
+    pendencias_ug = (df_final['DIFERENÇA'].abs() > 0.009).groupby(df_final['UG']).sum()
+    ugs_unicas = ordenar_ugs(pendencias_ug.index)
     card_data_matrix = []
     row_cards = []
 
     for i, ug in enumerate(ugs_unicas):
-        df_ug = df_final[df_final['UG'] == ug]
-        pendencias = len(df_ug[abs(df_ug['DIFERENÇA']) > 0.009])
-        
-        cor_valor = colors.red if pendencias > 0 else colors.green
+        pendencias = int(pendencias_ug[ug])
         cor_borda = colors.red if pendencias > 0 else colors.green
         
         sub_data = [
-            [Paragraph(ug, st_card_title)],
-            [Paragraph(str(pendencias), ParagraphStyle(name='V', parent=st_card_value, textColor=cor_valor))],
-            [Paragraph("PENDÊNCIAS", st_card_label)]
+            [Paragraph(ug, est["card_titulo"])],
+            [Paragraph(str(pendencias), est["card_valor_pendente"] if pendencias > 0 else est["card_valor_ok"])],
+            [Paragraph("PENDÊNCIAS", est["card_label"])]
         ]
         sub_table = Table(sub_data, colWidths=[48*mm])
         sub_table.setStyle(TableStyle([
@@ -536,8 +820,7 @@ def gerar_pdf_conciliacao(df_final):
     # ==========================================
     # 2. TABELA DE TOTAIS POR UG NO PDF
     # ==========================================
-    header_style = ParagraphStyle(name='SectionHeader', parent=styles['Heading2'], fontName='Helvetica-Bold', fontSize=12, alignment=0, textColor=colors.white, backColor=colors.black, padding=8, borderPadding=6)
-    story.append(KeepTogether(Paragraph("RESUMO DE TOTAIS POR UG", header_style)))
+    story.append(KeepTogether(Paragraph("RESUMO DE TOTAIS POR UG", est["secao"])))
 
     cols_resumo = ["UG", "CÓDIGO", "DESCRIÇÃO", "CONTA", "RAZÃO", "EXTRATO", "DIFERENÇA"]
     data_resumo = [cols_resumo]
@@ -552,18 +835,18 @@ def gerar_pdf_conciliacao(df_final):
         ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
     ]
 
-    ugs_resumo = sorted([ug for ug in df_final['UG'].unique() if ug != 'N/D'])
+    # Totais e subtotais de todas as UGs em uma única passada
+    valores = ['RAZÃO', 'EXTRATO', 'DIFERENÇA']
+    totais_ug = df_final.groupby('UG')[valores].sum()
+    totais_grupo = df_final.groupby(['UG', 'GRUPO'])[valores].sum()
+    ugs_resumo = sorted([ug for ug in totais_ug.index if ug != 'N/D'])
     row_idx = 1
     
     for ug in ugs_resumo:
-        df_ug = df_final[df_final['UG'] == ug]
-        total_razao = df_ug['RAZÃO'].sum()
-        total_extrato = df_ug['EXTRATO'].sum()
-        total_dif = df_ug['DIFERENÇA'].sum()
+        total_razao, total_extrato, total_dif = totais_ug.loc[ug]
         
         # --- INJEÇÃO CAIXA ---
-        valores_caixa = {'PMB': 86.65, 'FMAS': 7.06, 'FME': 4614.80}
-        valor_caixa = valores_caixa.get(str(ug).strip().upper(), 0.0)
+        valor_caixa = VALORES_CAIXA.get(str(ug).strip().upper(), 0.0)
         
         total_razao += valor_caixa
         total_extrato += valor_caixa
@@ -593,11 +876,8 @@ def gerar_pdf_conciliacao(df_final):
         
         # Linhas de Subtotal
         for grupo in ['APLICACAO', 'MOVIMENTO']:
-            df_grupo = df_ug[df_ug['GRUPO'] == grupo]
-            if not df_grupo.empty:
-                sub_razao = df_grupo['RAZÃO'].sum()
-                sub_extrato = df_grupo['EXTRATO'].sum()
-                sub_dif = df_grupo['DIFERENÇA'].sum()
+            if (ug, grupo) in totais_grupo.index:
+                sub_razao, sub_extrato, sub_dif = totais_grupo.loc[(ug, grupo)]
                 nome_grupo = "Aplicação" if grupo == 'APLICACAO' else "Movimento"
                 
                 data_resumo.append([
@@ -616,14 +896,19 @@ def gerar_pdf_conciliacao(df_final):
         t_resumo.setStyle(TableStyle(ts_resumo))
         story.append(t_resumo)
         story.append(Spacer(1, 10*mm))
+    return story
 
+def story_ug_pdf(ug, df_ug):
     # ==========================================
-    # 3. TABELAS DETALHADAS
+    # 3. TABELAS DETALHADAS (UMA SEÇÃO POR UG)
     # ==========================================
-    def add_data_table(df_part, titulo_secao):
-        if df_part.empty: return
+    est = ESTILOS_PDF
+    story = []
+    for grupo, titulo_secao in (('APLICACAO', "Contas Aplicação"), ('MOVIMENTO', "Contas Movimento")):
+        df_part = df_ug[df_ug['GRUPO'] == grupo]
+        if df_part.empty: continue
         
-        story.append(KeepTogether(Paragraph(titulo_secao.upper(), header_style)))
+        story.append(KeepTogether(Paragraph(f"{ug} - {titulo_secao}".upper(), est["secao"])))
 
         cols_pdf = ["UG", "CÓDIGO", "DESCRIÇÃO", "CONTA", "RAZÃO", "EXTRATO", "DIFERENÇA", "ARQUIVO"]
         data = [cols_pdf]
@@ -640,39 +925,67 @@ def gerar_pdf_conciliacao(df_final):
             ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
         ]
 
-        for i, (idx, row) in enumerate(df_part.iterrows()):
-            dif = row['DIFERENÇA']
-            row_data = [
-                str(row['UG']),
-                str(row['CÓDIGO']),
-                Paragraph(str(row['DESCRIÇÃO']), ParagraphStyle(name='DescTiny', fontSize=7)), 
-                str(row['CONTA']),
-                formatar_moeda(row['RAZÃO']),
-                formatar_moeda(row['EXTRATO']),
+        arquivos = df_part['ARQUIVO_ORIGEM'] if 'ARQUIVO_ORIGEM' in df_part.columns else [''] * len(df_part)
+        linhas = zip(df_part['UG'], df_part['CÓDIGO'], df_part['DESCRIÇÃO'], df_part['CONTA'], df_part['RAZÃO'], df_part['EXTRATO'], df_part['DIFERENÇA'], arquivos)
+        for i, (ug_linha, codigo, descricao, conta, razao, extrato, dif, arquivo) in enumerate(linhas, start=1):
+            data.append([
+                str(ug_linha),
+                str(codigo),
+                Paragraph(str(descricao), est["detalhe"]), 
+                str(conta),
+                formatar_moeda(razao),
+                formatar_moeda(extrato),
                 formatar_moeda(dif),
-                Paragraph(str(row.get('ARQUIVO_ORIGEM', '')), ParagraphStyle(name='DescTiny', fontSize=7))
-            ]
-            data.append(row_data)
+                Paragraph(str(arquivo), est["detalhe"])
+            ])
             
             if abs(dif) > 0.009:
-                ts.append(('TEXTCOLOR', (6, i+1), (6, i+1), colors.red))
-                ts.append(('FONTNAME', (6, i+1), (6, i+1), 'Helvetica-Bold'))
+                ts.append(('TEXTCOLOR', (6, i), (6, i), colors.red))
+                ts.append(('FONTNAME', (6, i), (6, i), 'Helvetica-Bold'))
 
         col_widths = [20*mm, 15*mm, 93*mm, 28*mm, 27*mm, 27*mm, 27*mm, 32*mm]
         t_data = Table(data, colWidths=col_widths, repeatRows=1)
         t_data.setStyle(TableStyle(ts))
         story.append(t_data)
         story.append(Spacer(1, 10*mm))
+    return story
 
-    df_app = df_final[df_final['GRUPO'] == 'APLICACAO'].copy()
-    df_mov = df_final[df_final['GRUPO'] == 'MOVIMENTO'].copy()
-
-    add_data_table(df_app, "Contas Aplicação")
-    add_data_table(df_mov, "Contas Movimento")
-
+def renderizar_parte_pdf(parte):
+    # Cada parte (capa ou UG) vira um PDF próprio, com as mesmas margens do relatório
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=landscape(A4), 
+                            rightMargin=10*mm, leftMargin=10*mm, topMargin=15*mm, bottomMargin=15*mm,
+                            title="Relatorio_Conciliacao.pdf")
+    story = story_capa_pdf(parte[1]) if parte[0] == "capa" else story_ug_pdf(parte[1], parte[2])
+    if not story: return b""
     doc.build(story)
     return buffer.getvalue()
 
+def executor_processos(max_workers):
+    # fork pelo mesmo motivo do executor_processos do Conciliador Bancário; os workers só usam o reportlab
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork"))
+
+def gerar_pdf_conciliacao(df_final, n_processos=N_PROCESSOS):
+    # Capa (cards + totais) e uma seção por UG, renderizadas em paralelo e unidas na ordem
+    partes = [("capa", df_final)]
+    grupos_ug = {ug: df_ug for ug, df_ug in df_final.groupby('UG', sort=False)}
+    partes += [("ug", ug, grupos_ug[ug]) for ug in ordenar_ugs(grupos_ug)]
+
+    n_processos = max(1, min(n_processos, len(partes)))
+    if n_processos > 1 and "fork" in multiprocessing.get_all_start_methods():
+        with executor_processos(n_processos) as executor:
+            pdfs = list(executor.map(renderizar_parte_pdf, partes))
+    else:
+        pdfs = [renderizar_parte_pdf(parte) for parte in partes]
+
+    with fitz.open() as documento:
+        for pdf_parte in pdfs:
+            if not pdf_parte: continue
+            with fitz.open(stream=pdf_parte, filetype="pdf") as doc_parte:
+                documento.insert_pdf(doc_parte)
+        documento.set_metadata({"title": "Relatorio_Conciliacao.pdf"})
+        return documento.tobytes(garbage=3, deflate=True)
+
 # ==============================================================================
 # 5. INTERFACE STREAMLIT
 # ==============================================================================
@@ -692,37 +1005,48 @@ if st.button("PROCESSAR CONCILIAÇÃO DE SALDOS BANCÁRIOS", use_container_width
     if up_extratos and up_planilha:
         with st.spinner("Processando..."):
             
-            temp_dir = tempfile.mkdtemp()
+            arquivo_compactado = None
             try:
-                # --- Preparação ---
-                path_zip = os.path.join(temp_dir, up_extratos.name)
-                with open(path_zip, "wb") as f:
-                    f.write(up_extratos.getbuffer())
-                
+                # --- Preparação (sem extrair para disco) ---
                 try:
-                    if up_extratos.name.lower().endswith('.rar'):
-                        with rarfile.RarFile(path_zip, 'r') as r: r.extractall(temp_dir)
-                    else:
-                        with zipfile.ZipFile(path_zip, 'r') as z: z.extractall(temp_dir)
+                    arquivo_compactado = abrir_compactado(up_extratos.name, up_extratos.getvalue())
                 except Exception as e:
                     st.error(f"Erro ao descompactar: {e}. Verifique se o arquivo não está corrompido.")
-                    shutil.rmtree(temp_dir)
                     st.stop()
 
                 # --- Leitura da Planilha ---
                 dados_excel = ler_planilha_e_consolidar(up_planilha)
                 if not dados_excel:
-                    shutil.rmtree(temp_dir)
                     st.stop()
 
+                codigos_ocultos = ['8920', '8243', '8242', '8007']
+                cols_view = ["UG", "CÓDIGO", "DESCRIÇÃO", "CONTA", "RAZÃO", "EXTRATO", "DIFERENÇA", "ARQUIVO_ORIGEM"]
+
+                # --- Acompanhamento parcial (atualizado a cada PDF lido) ---
+                progresso = st.progress(0.0, text="Lendo extratos...")
+                quadro_parcial = st.empty()
+                ultima_tabela = [0.0]
+
+                def acompanhar_leitura(lidos, total, linhas):
+                    df_parcial = pd.DataFrame(linhas)
+                    df_parcial = df_parcial[~((df_parcial['GRUPO'] == 'MOVIMENTO') & (df_parcial['CÓDIGO'].astype(str).isin(codigos_ocultos)))]
+                    df_parcial = df_parcial.assign(tem_diferenca=abs(df_parcial['DIFERENÇA']) > 0.009)
+                    progresso.progress(lidos / total, text=f"{lidos}/{total} PDFs, {int(df_parcial['tem_diferenca'].sum())} divergências até agora")
+                    # Tabela redesenhada no máximo uma vez por segundo (e sempre no último PDF)
+                    if lidos < total and time.perf_counter() - ultima_tabela[0] < 1: return
+                    ultima_tabela[0] = time.perf_counter()
+                    df_parcial = df_parcial.sort_values(by=['tem_diferenca', 'UG', 'CONTA'], ascending=[False, True, True])
+                    quadro_parcial.dataframe(df_parcial[cols_view], use_container_width=True, hide_index=True)
+
                 # --- Processamento ---
-                df_final = processar_confronto(temp_dir, dados_excel)
+                df_final, df_leitura, df_ambiguos = processar_confronto(listar_pdfs_compactado(arquivo_compactado), dados_excel, acompanhar_leitura)
+                progresso.empty()
+                quadro_parcial.empty()
 
                 if not df_final.empty:
                     # ==========================================================
                     # FILTRO GLOBAL DE CONTAS A SEREM OCULTADAS
                     # ==========================================================
-                    codigos_ocultos = ['8920', '8243', '8242', '8007']
                     mascara_ocultar = (df_final['GRUPO'] == 'MOVIMENTO') & (df_final['CÓDIGO'].astype(str).isin(codigos_ocultos))
                     df_final = df_final[~mascara_ocultar].copy()
 
@@ -737,7 +1061,6 @@ if st.button("PROCESSAR CONCILIAÇÃO DE SALDOS BANCÁRIOS", use_container_width
                         ascending=[False, True, True]
                     ).drop(columns=['UG_Sort', 'tem_diferenca'])
 
-                    cols_view = ["UG", "CÓDIGO", "DESCRIÇÃO", "CONTA", "RAZÃO", "EXTRATO", "DIFERENÇA", "ARQUIVO_ORIGEM"]
                     cols_validas = [c for c in cols_view if c in df_final.columns]
                     
                     df_view = df_final[cols_validas].copy()
@@ -890,19 +1213,34 @@ if st.button("PROCESSAR CONCILIAÇÃO DE SALDOS BANCÁRIOS", use_container_width
                     pdf_bytes = gerar_pdf_conciliacao(df_final)
 
                     st.success("Processamento concluído com sucesso!")
+                    n_cache = int((df_leitura['STATUS'] == "Cache").sum())
+                    if n_cache:
+                        st.info(f"{n_cache} de {len(df_leitura)} PDFs reaproveitados do cache (mesmo conteúdo já lido antes); {len(df_leitura) - n_cache} lidos agora.")
 
                     col_d1, col_d2 = st.columns(2)
                     with col_d1:
                         st.download_button("BAIXAR RELATÓRIO EM EXCEL", output_excel, "Relatorio_Conciliacao.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
                     with col_d2:
                         st.download_button("BAIXAR RELATÓRIO EM PDF", pdf_bytes, "Relatorio_Conciliacao.pdf", "application/pdf", use_container_width=True)
+
+                    # Associações PDF x conta que merecem conferência
+                    if not df_ambiguos.empty:
+                        with st.expander(f"⚠️ Associações ambíguas ({len(df_ambiguos)})"):
+                            st.dataframe(df_ambiguos, use_container_width=True, hide_index=True)
+
+                    # Tempo de leitura de cada extrato (mais lentos primeiro)
+                    with st.expander(f"Tempo de leitura por arquivo ({len(df_leitura)} PDFs)"):
+                        falhas = df_leitura[~df_leitura['STATUS'].isin(["OK", "Cache"])]
+                        if not falhas.empty:
+                            st.warning(f"{len(falhas)} arquivo(s) não puderam ser lidos (tempo esgotado ou falha no processo).")
+                        st.dataframe(df_leitura.sort_values("TEMPO (s)", ascending=False), use_container_width=True, hide_index=True)
                 else:
                     st.warning("O processamento não gerou dados. Verifique os arquivos.")
             
             except Exception as e:
                 st.error(f"Erro fatal: {e}")
             finally:
-                if os.path.exists(temp_dir):
-                    shutil.rmtree(temp_dir)
+                if arquivo_compactado is not None:
+                    arquivo_compactado.close()
     else:
         st.warning("⚠️ Selecione o arquivo ZIP/RAR e a Planilha Excel primeiro.")
@@ -0,0 +1,63 @@
+# Benchmark das regras de saldo por banco: tempo de leitura do texto, tempo das regras e taxa de saldos encontrados.
+# Uso: python tests/benchmark_regras_saldo.py <corpus.zip | pasta com PDFs>
+import io
+import os
+import sys
+import time
+import zipfile
+
+import pandas as pd
+import pdfplumber
+
+from pagina import carregar_funcoes
+
+funcoes = carregar_funcoes(
+    "Conciliador de Saldos Bancários.py", "identificar_banco", "limpar_numero", "aplicar_estrategia", "saldo_por_banco",
+    "RE_VALOR", "RE_DATA_COMPLETA", "RE_DATA_CURTA", "RE_MES", "ESTRATEGIAS_DO_FIM", "REGRAS_SALDO", "REGRAS_PADRAO",
+)
+identificar_banco = funcoes["identificar_banco"]
+saldo_por_banco = funcoes["saldo_por_banco"]
+
+
+def listar_pdfs(caminho):
+    # (nome, bytes) de cada PDF do corpus
+    if os.path.isdir(caminho):
+        for raiz, _, nomes in os.walk(caminho):
+            for nome in sorted(n for n in nomes if n.lower().endswith(".pdf")):
+                with open(os.path.join(raiz, nome), "rb") as f: yield nome, f.read()
+        return
+    with zipfile.ZipFile(caminho) as arquivo:
+        for info in arquivo.infolist():
+            if info.is_dir() or "__MACOSX" in info.filename or not info.filename.lower().endswith(".pdf"): continue
+            yield os.path.basename(info.filename), arquivo.read(info)
+
+
+def benchmark_regras_saldo(arquivos_pdf):
+    medidas = []
+    for nome, pdf_bytes in arquivos_pdf:
+        inicio = time.perf_counter()
+        try:
+            with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+                texto = "".join("\n" + t for t in (p.extract_text() for p in pdf.pages) if t)
+        except Exception:
+            medidas.append({"BANCO": "Erro", "LEITURA": time.perf_counter() - inicio, "REGRAS": 0.0, "ACHOU": False})
+            continue
+        meio = time.perf_counter()
+        banco = identificar_banco(texto) if texto.strip() else "Imagem"
+        saldo = saldo_por_banco(texto, banco, nome.lower()) if banco != "Imagem" else None
+        medidas.append({"BANCO": banco, "LEITURA": meio - inicio, "REGRAS": time.perf_counter() - meio, "ACHOU": saldo is not None})
+
+    df = pd.DataFrame(medidas, columns=["BANCO", "LEITURA", "REGRAS", "ACHOU"])
+    resumo = df.groupby("BANCO").agg(
+        ARQUIVOS=("ACHOU", "size"), SALDOS_ENCONTRADOS=("ACHOU", "sum"),
+        LEITURA_S=("LEITURA", "sum"), REGRAS_MS=("REGRAS", "sum"),
+    ).reset_index()
+    resumo["TAXA_ACERTO_%"] = (100 * resumo["SALDOS_ENCONTRADOS"] / resumo["ARQUIVOS"]).round(1)
+    resumo["LEITURA_S"] = resumo["LEITURA_S"].round(2)
+    resumo["REGRAS_MS"] = (resumo["REGRAS_MS"] * 1000).round(2)
+    return resumo
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2: sys.exit("Uso: python tests/benchmark_regras_saldo.py <corpus.zip | pasta com PDFs>")
+    print(benchmark_regras_saldo(listar_pdfs(sys.argv[1])).to_string(index=False))
@@ -0,0 +1,27 @@
+import ast
+import math
+import os
+import re
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+PASTA_PAGINAS = os.path.join(os.path.dirname(__file__), "..", "pages")
+
+
+def carregar_funcoes(pagina, *nomes):
+    # As páginas são scripts do Streamlit: compila só as funções e constantes pedidas, sem executar a interface
+    caminho = os.path.join(PASTA_PAGINAS, pagina)
+    with open(caminho, encoding="utf-8") as f:
+        arvore = ast.parse(f.read())
+
+    def pedido(n):
+        if isinstance(n, ast.FunctionDef): return n.name in nomes
+        return isinstance(n, ast.Assign) and any(isinstance(t, ast.Name) and t.id in nomes for t in n.targets)
+
+    corpo = [n for n in arvore.body if pedido(n)]
+    escopo = {"pd": pd, "np": np, "re": re, "time": time, "math": math, "deque": deque}
+    exec(compile(ast.Module(body=corpo, type_ignores=[]), caminho, "exec"), escopo)
+    return escopo
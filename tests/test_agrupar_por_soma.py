@@ -0,0 +1,46 @@
+import random
+
+import numpy as np
+import pandas as pd
+
+from pagina import carregar_funcoes
+
+funcoes = carregar_funcoes(
+    "Conciliador Bancário.py", "valor_em_centavos", "buscar_subconjunto", "agrupar_por_soma",
+    "LIMITE_ITENS_AGRUPAMENTO", "LIMITE_ACASO_AGRUPAMENTO", "TEMPO_LIMITE_AGRUPAMENTO_DIA", "DOC_NAO_LOCALIZADO",
+)
+agrupar_por_soma = funcoes["agrupar_por_soma"]
+NAO_LOCALIZADO = funcoes["DOC_NAO_LOCALIZADO"]
+DATA = "05/01/2026"
+
+
+def agrupar(extrato, razao):
+    # extrato/razao: [(Documento, valor)] na mesma data -> [(posição no extrato, [posições no razão])]
+    df_pdf = pd.DataFrame({'Data': DATA, 'Documento': [d for d, _ in extrato], 'Valor_Extrato': [v for _, v in extrato]})
+    df_excel = pd.DataFrame({'Data': DATA, 'Documento': [d for d, _ in razao], 'Valor_Razao': [v for _, v in razao]})
+    return agrupar_por_soma(df_pdf, df_excel, np.zeros(len(df_pdf), bool), np.zeros(len(df_excel), bool))
+
+
+def test_debito_dividido_em_lancamentos_nao_localizados():
+    razao = [(NAO_LOCALIZADO, 1200.00), ("888888", 730.15), (NAO_LOCALIZADO, 45.90), ("777777", 310.00), ("654321", 99.99)]
+    assert agrupar([("123456", 2240.15)], razao) == [(0, [0, 1, 3])]
+
+
+def test_debito_sem_contrapartida_fica_como_divergencia():
+    # 60 sobras do razão sem documento e um débito sem relação com elas: nenhuma soma pode ser aceita
+    rng = random.Random(2026)
+    for _ in range(20):
+        razao = [(NAO_LOCALIZADO, rng.randint(1000, 200000) / 100) for _ in range(60)]
+        assert agrupar([("123456", rng.randint(100000, 1000000) / 100)], razao) == []
+
+
+def test_lancamento_com_documento_do_extrato_nao_entra_no_agrupamento():
+    # 500,00 tem o documento de outro débito do dia: pertence a ele, não à soma do 123456
+    razao = [(NAO_LOCALIZADO, 1500.00), ("222222", 500.00)]
+    assert agrupar([("123456", 2000.00), ("222222", 480.00)], razao) == []
+
+
+def test_combinacao_ambigua_fica_como_divergencia():
+    # 1.000,00 = 600 + 400 = 700 + 300: não há como saber quais lançamentos compõem o débito
+    razao = [(NAO_LOCALIZADO, v) for v in (600.00, 400.00, 700.00, 300.00)]
+    assert agrupar([("123456", 1000.00)], razao) == []
@@ -0,0 +1,20 @@
+import pandas as pd
+
+from pagina import carregar_funcoes
+
+funcoes = carregar_funcoes("Conciliador Bancário.py", "serializar_colunas", "restaurar_colunas")
+serializar_colunas = funcoes["serializar_colunas"]
+restaurar_colunas = funcoes["restaurar_colunas"]
+
+
+def test_coordenadas_ausentes_voltam_como_none(tmp_path):
+    # Lançamento sem caixa localizada no extrato: o marcador só desenha tuplas, então não pode voltar NaN
+    df = pd.DataFrame({
+        'Data': ["05/01/2026", "06/01/2026"],
+        'Valor_Extrato': [150.0, 89.9],
+        'coords': [(0, 10.5, 20.0, 60.25, 30.0), None],
+    })
+    caminho = tmp_path / "coords.parquet"
+    serializar_colunas(df).to_parquet(caminho)
+    restaurado = restaurar_colunas(pd.read_parquet(caminho))
+    assert restaurado['coords'].tolist() == [(0, 10.5, 20.0, 60.25, 30.0), None]
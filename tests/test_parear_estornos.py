@@ -0,0 +1,41 @@
+import random
+
+import pandas as pd
+
+from pagina import carregar_funcoes
+
+parear_estornos = carregar_funcoes("Conciliador Bancário.py", "valor_em_centavos", "parear_estornos")["parear_estornos"]
+
+
+def parear_estornos_loop(df_estornos, df_originais):
+    # Implementação anterior: cada estorno, em ordem, anula o primeiro original livre de mesma Data e Valor
+    originais_anulados = set()
+    for _, row_est in df_estornos.iterrows():
+        cand = df_originais[
+            (df_originais['Data'] == row_est['Data']) &
+            (abs(df_originais['Valor_Razao'] - row_est['Valor_Razao']) < 0.01) &
+            (~df_originais.index.isin(originais_anulados))
+        ]
+        if not cand.empty:
+            originais_anulados.add(cand.index[0])
+    return originais_anulados
+
+
+def razao_aleatorio(rng, n):
+    datas = [f"{d:02d}/01/2026" for d in rng.sample(range(1, 29), 3)]
+    valores = [round(rng.uniform(1, 500), 2) for _ in range(4)] + [float('nan')]
+    df = pd.DataFrame({
+        'Status': [rng.choice(["Original", "Estorno"]) for _ in range(n)],
+        'Data': [rng.choice(datas) for _ in range(n)],
+        'Valor_Razao': [rng.choice(valores) for _ in range(n)],
+    })
+    return df.sample(frac=1, random_state=rng.randrange(10**6))  # índice fora de ordem, como após filtros
+
+
+def test_parear_estornos_equivale_ao_loop():
+    rng = random.Random(2026)
+    for _ in range(300):
+        df = razao_aleatorio(rng, rng.randint(0, 40))
+        mask = df['Status'] == "Estorno"
+        df_estornos, df_originais = df[mask], df[~mask]
+        assert parear_estornos(df_estornos, df_originais) == parear_estornos_loop(df_estornos, df_originais)